@@ -0,0 +1,47 @@
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ENTRY_POINTS = ['start_bot', 'start_dashboard', 'start_price_stream', 'start_maintenance', 'bot.robot', 'dashboard.app', 'dashboard_wsgi']
+
+def import_time(module):
+    # Cold import of module in a fresh interpreter; returns the cumulative
+    # import time reported by -X importtime and the wall time of the process
+    t0 = time.perf_counter()
+    r = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module], capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    if r.returncode != 0:
+        errors = [line for line in r.stderr.splitlines() if not line.startswith('import time:')]
+        return None, wall, errors[-1] if errors else r.returncode
+    cumulative = None
+    for line in r.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = [f.strip() for f in line[len('import time:'):].split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            cumulative = int(fields[1]) / 1e6
+    return cumulative, wall, None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS, help="Modules to import")
+    parser.add_argument('-n', '--repeat', default=5, type=int, help="Runs per module, the best one is reported")
+    parser.add_argument('-o', '--output', default=None, type=str, help="Append results as a JSON line to this file")
+    args = parser.parse_args()
+    results = {}
+    for module in args.modules:
+        runs = [import_time(module) for _ in range(args.repeat)]
+        errors = [e for _, _, e in runs if e is not None]
+        if errors:
+            print("%-20s failed: %s" % (module, errors[-1]))
+            continue
+        results[module] = {'import': min(c for c, _, _ in runs), 'wall': min(w for _, w, _ in runs)}
+        print("%-20s import %.3fs  process %.3fs" % (module, results[module]['import'], results[module]['wall']))
+    if args.output is not None:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps({'time': time.time(), 'python': sys.version.split()[0], 'results': results}) + '\n')
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,222 @@
+import math
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class TimerWheel(threading.Thread):
+    # Hashed timer wheel: one thread advances a ring of slots every
+    # `resolution` seconds and fires the callbacks that fall due, so any number
+    # of pending timers costs a single thread.
+
+    def __init__(self, resolution=1.0, slots=512):
+        threading.Thread.__init__(self, name='timer-wheel')
+        self.daemon = True
+        self.resolution = resolution
+        self.slots = [[] for _ in range(slots)]
+        self.position = 0
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def schedule(self, delay, callback, *args):
+        ticks = max(1, int(math.ceil(delay / self.resolution)))
+        with self.lock:
+            slot = (self.position + ticks) % len(self.slots)
+            self.slots[slot].append([(ticks - 1) // len(self.slots), callback, args])
+
+    def _advance(self):
+        with self.lock:
+            self.position = (self.position + 1) % len(self.slots)
+            due = []
+            pending = []
+            for entry in self.slots[self.position]:
+                if entry[0] == 0:
+                    due.append(entry)
+                else:
+                    entry[0] -= 1
+                    pending.append(entry)
+            self.slots[self.position] = pending
+        for _, callback, args in due:
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error("Timer callback failed: %s" % e, exc_info=True)
+
+    def run(self):
+        next_tick = time.monotonic()
+        while not self._stop_event.is_set():
+            next_tick += self.resolution
+            wait = next_tick - time.monotonic()
+            if wait > 0 and self._stop_event.wait(wait):
+                break
+            self._advance()
+
+    def close(self):
+        self._stop_event.set()
+
+class ParentOrder(object):
+
+    __slots__ = ('product_id', 'side', 'funds', 'remaining', 'slices', 'increment', 'min_funds', 'children', 'done')
+
+    def __init__(self, product_id, side, funds, slices, increment='', min_funds=0):
+        self.product_id = product_id
+        self.side = side
+        self.funds = funds
+        self.remaining = funds
+        self.slices = slices
+        self.increment = increment
+        self.min_funds = min_funds
+        # order id -> [funds, filled funds] of the children still open
+        self.children = {}
+        self.done = False
+
+class ExecutionScheduler(object):
+    # Splits large market orders into child orders spread over `duration`
+    # seconds. Child size is TWAP (remaining / slices left) or, with a
+    # participation rate and ticker volumes available, a fraction of the
+    # traded volume over one interval. Children are placed from a small
+    # worker pool driven by a shared timer wheel; fills are tracked from the
+    # user channel through on_user_message, and whatever a canceled child
+    # left unfilled goes back to the parent for the next slices. An optional cap(product_id, side,
+    # funds, increment) limits each child to the book depth at placement time.
+
+    def __init__(self, auth_client, slices, duration, participation_rate=0, ticker=None, workers=4, wheel=None, cap=None):
+        self.auth_client = auth_client
+        self.cap = cap
+        self.slices = max(1, slices)
+        self.interval = float(duration) / self.slices
+        self.participation_rate = participation_rate
+        self.ticker = ticker
+        self.wheel = wheel if wheel is not None else TimerWheel()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='execution')
+        self.parents = {}
+        self.children = {}
+        self.submitted = queue.Queue()
+        self.lock = threading.Lock()
+
+    def start(self):
+        if not self.wheel.is_alive():
+            self.wheel.start()
+
+    def is_active(self, product_id):
+        with self.lock:
+            parent = self.parents.get(product_id)
+            return parent is not None and not parent.done
+
+    def submit(self, product_id, side, funds, increment='', min_funds=0):
+        with self.lock:
+            if product_id in self.parents and not self.parents[product_id].done:
+                logger.debug("Execution already running for %s, ignoring new order" % product_id)
+                return None
+            previous = self.parents.get(product_id)
+            if previous is not None:
+                # Children whose done message never came
+                for order_id in previous.children:
+                    self.children.pop(order_id, None)
+            parent = ParentOrder(product_id, side, funds, self.slices, increment=increment, min_funds=min_funds)
+            self.parents[product_id] = parent
+        logger.debug("Scheduling %s %s %s in %s slices every %ss" % (side, funds, product_id, self.slices, self.interval))
+        self.wheel.schedule(0, self._dispatch, parent)
+        return parent
+
+    def _dispatch(self, parent):
+        self.executor.submit(self._place_child, parent)
+
+    def _round_down(self, value, increment):
+        n = len(increment.split('.')[-1]) if increment else 2
+        return math.floor(value * 10 ** n) / 10 ** n
+
+    def _child_funds(self, parent):
+        if parent.slices <= 1:
+            return parent.remaining
+        funds = parent.remaining / parent.slices
+        if self.participation_rate > 0 and self.ticker is not None:
+            volume = getattr(self.ticker, 'last_volumes', {}).get(parent.product_id)
+            price = self.ticker.last_prices.get(parent.product_id)
+            if volume is not None and price is not None:
+                funds = self.participation_rate * volume / 86400.0 * self.interval * price
+        funds = min(parent.remaining, self._round_down(funds, parent.increment))
+        if parent.remaining - funds < parent.min_funds:
+            funds = parent.remaining
+        return max(funds, min(parent.min_funds, parent.remaining))
+
+    def _place_child(self, parent):
+        if parent.done:
+            return
+        funds = self._round_down(self._child_funds(parent), parent.increment)
+        if self.cap is not None and funds > 0:
+            try:
+                funds = self.cap(parent.product_id, parent.side, funds, parent.increment)
+            except Exception as e:
+                logger.error("Unable to cap child order for %s: %s" % (parent.product_id, e), exc_info=True)
+                funds = 0
+            if funds < parent.min_funds:
+                # Too little depth for a valid order, try again next slice
+                logger.debug("Skipping child order for %s, capped to %s" % (parent.product_id, funds))
+                funds = 0
+        parent.slices -= 1
+        if funds > 0:
+            try:
+                r = self.auth_client.place_market_order(product_id=parent.product_id, side=parent.side, funds=funds)
+            except Exception as e:
+                logger.error("Unable to place child order for %s: %s" % (parent.product_id, e), exc_info=True)
+                r = {}
+            logger.debug("Child order response is: %s" % r)
+            if r.get('status') == 'pending' and 'id' in r:
+                with self.lock:
+                    parent.children[r['id']] = [funds, 0.0]
+                    self.children[r['id']] = parent
+                    parent.remaining = self._round_down(parent.remaining - funds, parent.increment)
+                self.submitted.put(r)
+        with self.lock:
+            if parent.remaining <= 0 or parent.slices <= 0 or (parent.remaining < parent.min_funds):
+                parent.done = True
+                logger.debug("Execution for %s finished with %s %s left" % (parent.product_id, parent.remaining, parent.side))
+                return
+        self.wheel.schedule(self.interval, self._dispatch, parent)
+
+    def _return_unfilled(self, parent, child):
+        # A canceled child gives its unfilled funds back to the parent, which
+        # is rescheduled for one more slice if it had already finished
+        unfilled = self._round_down(child[0] - child[1], parent.increment)
+        if unfilled <= 0:
+            return
+        with self.lock:
+            parent.remaining = self._round_down(parent.remaining + unfilled, parent.increment)
+            restart = parent.done and self.parents.get(parent.product_id) is parent and parent.remaining >= parent.min_funds
+            if restart:
+                parent.done = False
+                parent.slices = max(parent.slices, 1)
+        logger.debug("Child order for %s canceled with %s unfilled, %s left" % (parent.product_id, unfilled, parent.remaining))
+        if restart:
+            self.wheel.schedule(self.interval, self._dispatch, parent)
+
+    def on_user_message(self, msg):
+        if msg.get('type') == 'match':
+            with self.lock:
+                parent = self.children.get(msg.get('taker_order_id'))
+                child = None if parent is None else parent.children.get(msg.get('taker_order_id'))
+                if child is not None:
+                    child[1] += float(msg.get('size', 0)) * float(msg.get('price', 0))
+        elif msg.get('type') == 'done':
+            with self.lock:
+                parent = self.children.pop(msg.get('order_id'), None)
+                child = None if parent is None else parent.children.pop(msg.get('order_id'), None)
+            if child is not None and msg.get('reason') == 'canceled':
+                self._return_unfilled(parent, child)
+
+    def drain_submitted(self):
+        orders = []
+        while True:
+            try:
+                orders.append(self.submitted.get_nowait())
+            except queue.Empty:
+                return orders
+
+    def close(self):
+        self.wheel.close()
+        self.executor.shutdown(wait=False)
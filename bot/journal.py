@@ -0,0 +1,303 @@
+import os
+import mmap
+import json
+import math
+import time
+import struct
+import logging
+import datetime
+import threading
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Append-only binary journal of the bot's inputs and decisions. Every record
+# is a fixed header (payload length, kind, wall clock timestamp) followed by
+# the payload: ticks are packed structs referring to symbols by index, every
+# other event is the JSON text, written as received when it already is JSON.
+# A truncated record at the end of the file (crash while writing) ends the
+# replay instead of failing it.
+
+MAGIC = b'CBJ1'
+HEADER = struct.Struct('<IBd')
+TICK = struct.Struct('<Hdd')
+
+SYMBOL = 1
+TICK_EVENT = 2
+USER = 3
+MARKET_CAPS = 4
+REST = 5
+CONFIGURATION = 6
+PRICES = 7
+WEIGHTS = 8
+POSITIONS = 9
+ORDERS = 10
+
+KINDS = {
+    SYMBOL: 'symbol',
+    TICK_EVENT: 'tick',
+    USER: 'user',
+    MARKET_CAPS: 'market_caps',
+    REST: 'rest',
+    CONFIGURATION: 'configuration',
+    PRICES: 'prices',
+    WEIGHTS: 'weights',
+    POSITIONS: 'positions',
+    ORDERS: 'orders'
+}
+KIND_IDS = {v: k for k, v in KINDS.items()}
+
+JOURNAL_PATH = 'journal'
+
+def new_journal_path(name, path=JOURNAL_PATH):
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, '%s-%s.bin' % (name, datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')))
+
+class Journal(object):
+    # Writer shared by the feed threads and the main loop. Records go through
+    # a buffered file under a lock; flush() is called once per bot tick.
+
+    def __init__(self, path, buffering=1 << 20):
+        self.path = path
+        self.symbols = {}
+        self.records = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path) and os.path.getsize(path) < len(MAGIC):
+            os.truncate(path, 0)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new:
+            # Symbol ids are per file, appending to an existing journal
+            # continues its table
+            end = len(MAGIC)
+            for kind, timestamp, payload in JournalReader(path):
+                end += HEADER.size + len(payload)
+                if kind == SYMBOL:
+                    self.symbols[payload.decode('utf-8')] = len(self.symbols)
+            if os.path.getsize(path) > end:
+                # Drop a record cut short by a crash, or everything appended
+                # after it would be read as part of it
+                logger.warning("Truncating %s partial bytes at the end of %s" % (os.path.getsize(path) - end, path))
+                os.truncate(path, end)
+        self._file = open(path, 'ab', buffering=buffering)
+        if new:
+            self._file.write(MAGIC)
+
+    def _write(self, kind, payload, timestamp=None):
+        record = HEADER.pack(len(payload), kind, time.time() if timestamp is None else timestamp) + payload
+        with self._lock:
+            self._file.write(record)
+            self.records += 1
+
+    def _symbol_id(self, symbol, timestamp=None):
+        i = self.symbols.get(symbol)
+        if i is None:
+            with self._lock:
+                i = self.symbols.get(symbol)
+                if i is None:
+                    i = len(self.symbols)
+                    payload = symbol.encode('utf-8')
+                    # Stamped like the tick it precedes, so replay(until=)
+                    # never stops between the two
+                    self._file.write(HEADER.pack(len(payload), SYMBOL, time.time() if timestamp is None else timestamp) + payload)
+                    self.records += 1
+                    self.symbols[symbol] = i
+        return i
+
+    def tick(self, symbol, price, volume=None, timestamp=None):
+        self._write(TICK_EVENT, TICK.pack(self._symbol_id(symbol, timestamp), price, math.nan if volume is None else volume), timestamp)
+
+    def raw(self, kind, msg, timestamp=None):
+        # For messages that are JSON already, e.g. straight from the websocket
+        self._write(kind, msg.encode('utf-8') if isinstance(msg, str) else msg, timestamp)
+
+    def event(self, kind, obj, timestamp=None):
+        self._write(kind, json.dumps(obj, default=str).encode('utf-8'), timestamp)
+
+    def rest(self, method, response, request=None, timestamp=None):
+        self.event(REST, {'method': method, 'request': request, 'response': response}, timestamp)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def _open_map(path):
+    f = open(path, 'rb')
+    size = os.fstat(f.fileno()).st_size
+    if size <= len(MAGIC):
+        f.close()
+        return None, None, size
+    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if m[:len(MAGIC)] != MAGIC:
+        m.close()
+        f.close()
+        raise ValueError("%s is not a journal file" % path)
+    return f, m, size
+
+class JournalReader(object):
+    # Iterates (kind, timestamp, payload) over a memory-mapped journal
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        f, m, size = _open_map(self.path)
+        if m is None:
+            return
+        try:
+            offset = len(MAGIC)
+            unpack_from = HEADER.unpack_from
+            header_size = HEADER.size
+            while offset + header_size <= size:
+                length, kind, timestamp = unpack_from(m, offset)
+                start = offset + header_size
+                offset = start + length
+                if offset > size:
+                    logger.warning("Truncated record at the end of %s" % self.path)
+                    break
+                yield kind, timestamp, m[start:offset]
+        finally:
+            m.close()
+            f.close()
+
+class ReplayState(object):
+    # What the bot knew after a prefix of the journal
+
+    def __init__(self):
+        self.symbols = []
+        self.last_prices = {}
+        self.last_volumes = {}
+        self.current_orders = {}
+        self.market_caps = {}
+        self.configuration = {}
+        self.prices = {}
+        self.target_weights = {}
+        self.positions = {}
+        self.orders = []
+        self.rest = {}
+        self.events = 0
+        self.timestamp = None
+
+    def apply_user(self, msg):
+        # Open order ids per product, from received and done messages
+        product = msg.get('product_id')
+        if product is None:
+            return
+        if msg.get('type') == 'received':
+            self.current_orders.setdefault(product, []).append(msg.get('order_id'))
+        elif msg.get('type') == 'done' and msg.get('order_id') in self.current_orders.get(product, []):
+            self.current_orders[product].remove(msg.get('order_id'))
+
+    def summary(self):
+        return {
+            'events': self.events,
+            'timestamp': None if self.timestamp is None else datetime.datetime.utcfromtimestamp(self.timestamp).isoformat(),
+            'last_prices': self.last_prices,
+            'current_orders': {k: v for k, v in self.current_orders.items() if v},
+            'target_weights': self.target_weights,
+            'positions': self.positions,
+            'orders': self.orders
+        }
+
+def replay(path, until=None, max_events=None):
+    # Rebuilds the state at timestamp `until` (epoch seconds) or after
+    # `max_events` records. The loop walks the map directly and unpacks ticks
+    # in place; JSON is only decoded for the other, much rarer, events.
+    state = ReplayState()
+    f, m, size = _open_map(path)
+    if m is None:
+        return state
+    symbols = state.symbols
+    last_prices = state.last_prices
+    last_volumes = state.last_volumes
+    unpack_header = HEADER.unpack_from
+    unpack_tick = TICK.unpack_from
+    header_size = HEADER.size
+    if max_events is None:
+        max_events = -1
+    events = 0
+    last = None
+    offset = len(MAGIC)
+    try:
+        while offset + header_size <= size and events != max_events:
+            length, kind, timestamp = unpack_header(m, offset)
+            start = offset + header_size
+            if start + length > size:
+                logger.warning("Truncated record at the end of %s" % path)
+                break
+            if until is not None and timestamp > until:
+                break
+            offset = start + length
+            events += 1
+            last = timestamp
+            if kind == TICK_EVENT:
+                i, price, volume = unpack_tick(m, start)
+                last_prices[symbols[i]] = price
+                if volume == volume:
+                    last_volumes[symbols[i]] = volume
+            elif kind == SYMBOL:
+                symbols.append(m[start:offset].decode('utf-8'))
+            else:
+                obj = json.loads(m[start:offset])
+                if kind == USER:
+                    state.apply_user(obj)
+                elif kind == MARKET_CAPS:
+                    state.market_caps = obj
+                elif kind == CONFIGURATION:
+                    state.configuration = obj
+                elif kind == PRICES:
+                    state.prices = obj
+                elif kind == WEIGHTS:
+                    state.target_weights = obj
+                elif kind == POSITIONS:
+                    state.positions = obj
+                elif kind == ORDERS:
+                    state.orders = obj
+                elif kind == REST:
+                    state.rest[obj.get('method')] = obj.get('response')
+    finally:
+        m.close()
+        f.close()
+    state.events = events
+    state.timestamp = last
+    return state
+
+def iter_events(path, kinds=None):
+    # Decoded events as dicts, for dumping and regression tests
+    symbols = []
+    for kind, timestamp, payload in JournalReader(path):
+        if kind == SYMBOL:
+            symbols.append(payload.decode('utf-8'))
+            continue
+        if kinds is not None and kind not in kinds:
+            continue
+        if kind == TICK_EVENT:
+            i, price, volume = TICK.unpack_from(payload)
+            data = {'product_id': symbols[i], 'price': price, 'volume_24h': None if math.isnan(volume) else volume}
+        else:
+            data = json.loads(payload)
+        yield {'kind': KINDS.get(kind, kind), 'timestamp': timestamp, 'data': data}
+
+def benchmark(path, ticks=2000000, pairs=50):
+    if os.path.exists(path):
+        os.remove(path)
+    journal = Journal(path)
+    symbols = ['C%s-BTC' % i for i in range(pairs)]
+    t0 = time.perf_counter()
+    for i in range(ticks):
+        journal.tick(symbols[i % pairs], 1 + (i % 1000) * 1e-5, 12345.6789)
+        if i % 10000 == 0:
+            journal.event(WEIGHTS, {c: 1.0 / pairs for c in symbols})
+    journal.close()
+    write_rate = journal.records / (time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    state = replay(path)
+    replay_rate = state.events / (time.perf_counter() - t0)
+    return write_rate, replay_rate, os.path.getsize(path)
+
+if __name__ == "__main__":
+    write_rate, replay_rate, size = benchmark('/tmp/journal_benchmark.bin')
+    print("%.0f records/s written, %.0f records/s replayed, %.1f MB" % (write_rate, replay_rate, size / 1e6))
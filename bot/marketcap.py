@@ -27,7 +27,7 @@ def get_market_cap(api_key):
         for c in data.get('data', {}):
             # print(c.get('id'), c.get('name'), c.get('symbol'), c.get('cmc_rank'), c.keys())
             if c.get('symbol') is not None:
-                market_cap_info[c.get('symbol')] = {'rank': c.get('cmc_rank'), 'supply': c.get('circulating_supply')}
+                market_cap_info[c.get('symbol')] = {'rank': c.get('cmc_rank'), 'supply': c.get('circulating_supply'), 'market_cap': c.get('quote', {}).get('EUR', {}).get('market_cap')}
         #   print(data.get('data'))
     except (ConnectionError, Timeout, TooManyRedirects) as e:
         logger.error('Could not retrieve market caps: %s' % e, exc_info=True)
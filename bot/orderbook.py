@@ -0,0 +1,203 @@
+import bisect
+import json
+import time
+import random
+import logging
+import threading
+from . import ws
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+BUY = 'buy'
+SELL = 'sell'
+
+class BookSide(object):
+    # Price levels kept as a sorted list of keys plus a key -> size dict.
+    # Bids are stored negated so index 0 is the best level on both sides.
+    # Finding a level is an O(log n) bisect, but adding or removing one shifts
+    # the list tail (an O(n) memmove); that is a few microseconds even for
+    # books 100 times deeper than Coinbase usually sends (see benchmark), and
+    # in exchange the best price is keys[0] and depth walks are plain slices.
+
+    def __init__(self, sign):
+        self.sign = sign
+        self.keys = []
+        self.sizes = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def clear(self):
+        self.keys = []
+        self.sizes = {}
+
+    def update(self, price, size):
+        key = self.sign * price
+        if size == 0:
+            if self.sizes.pop(key, None) is not None:
+                del self.keys[bisect.bisect_left(self.keys, key)]
+        else:
+            if key not in self.sizes:
+                bisect.insort(self.keys, key)
+            self.sizes[key] = size
+
+    def load(self, levels):
+        self.sizes = {self.sign * float(p): float(s) for p, s in levels if float(s) != 0}
+        self.keys = sorted(self.sizes)
+
+    def best(self):
+        if not self.keys:
+            return None
+        return self.sign * self.keys[0]
+
+    def levels(self):
+        for key in self.keys:
+            yield self.sign * key, self.sizes[key]
+
+    def within(self, limit):
+        # Levels up to and including limit price
+        end = bisect.bisect_right(self.keys, self.sign * limit)
+        for key in self.keys[:end]:
+            yield self.sign * key, self.sizes[key]
+
+class OrderBook(object):
+
+    def __init__(self, product_id):
+        self.product_id = product_id
+        self.bids = BookSide(-1)
+        self.asks = BookSide(1)
+        self.lock = threading.Lock()
+        self.updated = None
+
+    def _side(self, side):
+        # Taking liquidity: a buy walks the asks, a sell walks the bids
+        return self.asks if side == BUY else self.bids
+
+    def apply_snapshot(self, bids, asks):
+        with self.lock:
+            self.bids.load(bids)
+            self.asks.load(asks)
+            self.updated = time.time()
+
+    def apply_changes(self, changes):
+        with self.lock:
+            for side, price, size in changes:
+                book_side = self.bids if side == BUY else self.asks
+                book_side.update(float(price), float(size))
+            self.updated = time.time()
+
+    def best_bid(self):
+        with self.lock:
+            return self.bids.best()
+
+    def best_ask(self):
+        with self.lock:
+            return self.asks.best()
+
+    def mid(self):
+        with self.lock:
+            bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return (bid + ask) / 2
+
+    def vwap(self, side, size=None, funds=None):
+        # Average fill price and filled size for a market order of the given
+        # base size or quote funds, (None, 0) if the book is empty
+        filled = 0.0
+        cost = 0.0
+        with self.lock:
+            for price, level in self._side(side).levels():
+                take = level
+                if size is not None:
+                    take = min(level, size - filled)
+                elif funds is not None:
+                    take = min(level, (funds - cost) / price)
+                filled += take
+                cost += take * price
+                if (size is not None and filled >= size) or (funds is not None and cost >= funds):
+                    break
+        if filled == 0:
+            return None, 0.0
+        return cost / filled, filled
+
+    def depth(self, side, bps):
+        # Base size and quote funds available within bps of the best price
+        with self.lock:
+            book_side = self._side(side)
+            best = book_side.best()
+            if best is None:
+                return 0.0, 0.0
+            limit = best * (1 + book_side.sign * bps / 10000.0)
+            size = 0.0
+            funds = 0.0
+            for price, level in book_side.within(limit):
+                size += level
+                funds += level * price
+        return size, funds
+
+    def cap_funds(self, side, funds, bps):
+        return min(funds, self.depth(side, bps)[1])
+
+class Level2Client(ws.CBChannelServer, threading.Thread):
+
+    def __init__(self, pairs, **kwargs):
+        ws.CBChannelServer.__init__(self, pairs, 'level2', **kwargs)
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.books = {p: OrderBook(p) for p in pairs}
+
+    def run(self):
+        self.connect()
+
+    def on_open(self):
+        logger.info("Connecting to LEVEL2 channel")
+        self.error = None
+
+    def on_message(self, msg):
+        if msg is not None:
+            msg = json.loads(msg)
+            book = self.books.get(msg.get('product_id'))
+            if book is None:
+                return
+            if msg.get('type') == 'l2update':
+                book.apply_changes(msg.get('changes', []))
+            elif msg.get('type') == 'snapshot':
+                book.apply_snapshot(msg.get('bids', []), msg.get('asks', []))
+
+    def on_close(self):
+        logger.error("Lost connection to LEVEL2")
+
+    def on_error(self, e):
+        self.error = e
+        logger.error("There was an error with LEVEL2 subscription: %s" % e)
+
+def benchmark(levels=1000, updates=1000000):
+    book = OrderBook('BENCH-BTC')
+    book.apply_snapshot(
+        [['%.8f' % (1 - i * 1e-5), '1.0'] for i in range(levels)],
+        [['%.8f' % (1 + i * 1e-5), '1.0'] for i in range(levels)])
+    r = random.Random(0)
+    changes = []
+    for i in range(updates):
+        side = BUY if i % 2 else SELL
+        offset = r.randint(0, 2 * levels) * 1e-5
+        price = 1 - offset if side == BUY else 1 + offset
+        changes.append([side, '%.8f' % price, '0' if r.random() < 0.3 else '%.4f' % r.random()])
+    t0 = time.perf_counter()
+    for change in changes:
+        book.apply_changes([change])
+    update_rate = updates / (time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    for i in range(10000):
+        book.vwap(BUY, funds=5.0)
+        book.depth(SELL, 50)
+    query_rate = 20000 / (time.perf_counter() - t0)
+    return update_rate, query_rate
+
+if __name__ == "__main__":
+    # A shallow book and a deep one, where the list shifts are largest
+    for levels in (1000, 100000):
+        update_rate, query_rate = benchmark(levels=levels, updates=200000)
+        print("%s levels per side: %.0f updates/s, %.0f queries/s" % (levels, update_rate, query_rate))
@@ -0,0 +1,159 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Bounded bookkeeping of the bot's orders. Open orders are small __slots__
+# records; once an order is done (or has been open longer than max_age,
+# e.g. its done message was lost during a reconnect) it is folded into a
+# per-pair aggregate and forgotten, so memory tracks open orders and pairs
+# rather than uptime. Messages arrive on the user channel thread while the
+# main loop submits and expires orders, so all state is behind one lock.
+# A match or done can beat the REST response that submits its order; those
+# are held for early_ttl seconds and applied when the order is submitted.
+
+MAX_EARLY = 10000
+
+class OrderRecord(object):
+
+    __slots__ = ('order_id', 'product_id', 'side', 'funds', 'submitted', 'filled_size', 'filled_funds')
+
+    def __init__(self, order_id, product_id, side, funds, submitted):
+        self.order_id = order_id
+        self.product_id = product_id
+        self.side = side
+        self.funds = funds
+        self.submitted = submitted
+        self.filled_size = 0.0
+        self.filled_funds = 0.0
+
+class PairAggregate(object):
+
+    __slots__ = ('orders', 'funds', 'filled_size', 'filled_funds', 'canceled', 'expired')
+
+    def __init__(self):
+        self.orders = 0
+        self.funds = 0.0
+        self.filled_size = 0.0
+        self.filled_funds = 0.0
+        self.canceled = 0
+        self.expired = 0
+
+    def add(self, order, reason):
+        self.orders += 1
+        self.funds += order.funds
+        self.filled_size += order.filled_size
+        self.filled_funds += order.filled_funds
+        if reason == 'canceled':
+            self.canceled += 1
+        elif reason == 'expired':
+            self.expired += 1
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+class OrderTracker(object):
+
+    def __init__(self, max_age=86400, early_ttl=60, clock=time.time):
+        self.max_age = max_age
+        self.early_ttl = early_ttl
+        self.clock = clock
+        self.open = {}
+        self.aggregates = {}
+        self.early = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.open)
+
+    def submit(self, r, now=None):
+        # Takes a place_market_order response, True if the order was accepted
+        if r.get('status') == 'pending' and 'id' in r and 'product_id' in r:
+            order = OrderRecord(r['id'], r['product_id'], r.get('side'), float(r.get('funds') or 0), self.clock() if now is None else now)
+            with self._lock:
+                self.open[order.order_id] = order
+                early = self.early.pop(order.order_id, None)
+                if early is not None:
+                    for msg in early[1]:
+                        self._apply(msg)
+                logger.debug("Submitted order %s for %s, %s orders open" % (order.order_id, order.product_id, len(self.open)))
+            return True
+        return False
+
+    def _complete(self, order, reason):
+        aggregate = self.aggregates.get(order.product_id)
+        if aggregate is None:
+            aggregate = self.aggregates[order.product_id] = PairAggregate()
+        aggregate.add(order, reason)
+
+    def _apply(self, msg):
+        # Applies a match or done, False if its order is not open
+        if msg.get('type') == 'match':
+            order = self.open.get(msg.get('taker_order_id')) or self.open.get(msg.get('maker_order_id'))
+            if order is None:
+                return False
+            size = float(msg.get('size', 0))
+            order.filled_size += size
+            order.filled_funds += size * float(msg.get('price', 0))
+        elif msg.get('type') == 'done':
+            order = self.open.pop(msg.get('order_id'), None)
+            if order is None:
+                return False
+            self._complete(order, msg.get('reason'))
+        return True
+
+    def _hold(self, order_id, msg, now):
+        if order_id is None:
+            return
+        early = self.early.get(order_id)
+        if early is None:
+            early = self.early[order_id] = (now, [])
+            while len(self.early) > MAX_EARLY:
+                self.early.popitem(last=False)
+        early[1].append(msg)
+
+    def _drop_early(self, now):
+        while self.early:
+            order_id, (received, _) = next(iter(self.early.items()))
+            if now - received <= self.early_ttl:
+                break
+            del self.early[order_id]
+
+    def on_user_message(self, msg):
+        if msg.get('type') not in ('match', 'done'):
+            return
+        with self._lock:
+            if self._apply(msg):
+                return
+            now = self.clock()
+            self._drop_early(now)
+            if msg.get('type') == 'match':
+                # Either side may be ours
+                self._hold(msg.get('taker_order_id'), msg, now)
+                self._hold(msg.get('maker_order_id'), msg, now)
+            else:
+                self._hold(msg.get('order_id'), msg, now)
+
+    def expire(self, now=None):
+        if now is None:
+            now = self.clock()
+        with self._lock:
+            self._drop_early(now)
+            expired = [order for order in self.open.values() if now - order.submitted > self.max_age]
+            for order in expired:
+                del self.open[order.order_id]
+                self._complete(order, 'expired')
+        if expired:
+            logger.warning("Expired %s orders without a done message" % len(expired))
+        return len(expired)
+
+    def open_funds(self):
+        with self._lock:
+            orders = list(self.open.values())
+        funds = {}
+        for order in orders:
+            funds[order.product_id] = funds.get(order.product_id, 0) + order.funds
+        return funds
@@ -1,5 +1,12 @@
 from . import ws
-import cbpro
+from .shard import ShardedTickerClient
+from .orderbook import Level2Client
+from .execution import ExecutionScheduler
+from .valuation import Valuation
+from .weights import WeightingEngine, RollingVolatility
+from .supervisor import ConnectionSupervisor
+from . import journal
+from .orders import OrderTracker
 import numpy as np
 import logging
 import logging.handlers
@@ -7,6 +14,10 @@ import time
 import json
 from .marketcap import get_market_cap
 import model.db as model
+import model.metrics as metrics
+import model.notify as notify
+from model.partitions import ensure_partitions
+from model.writer import TickWriter
 import os
 import threading
 
@@ -15,25 +26,47 @@ logger.addHandler(logging.NullHandler())
 
 class UserClient(ws.CBChannelServer, threading.Thread):
     
-    def __init__(self, pairs, **kwargs):
+    def __init__(self, pairs, execution_id=None, async_db=False, **kwargs):
         ws.CBChannelServer.__init__(self, pairs, 'user', **kwargs)
         threading.Thread.__init__(self)
         self.daemon = True
-        self.current_orders = {}
+        self.execution_id = execution_id
+        self.async_db = async_db
+        self.listeners = []
+        self.session = None
+        self.journal = None
+        self._pair_ids = {}
 
     def run(self):
         self.connect()
 
     def on_open(self):
         logger.info("Connecting to USER channel")
-        self.session = model.connect_to_session()
+        # One session for the life of the client, reused across reconnects
+        if self.session is None and not self.async_db:
+            self.session = model.connect_to_session()
         self.error = None
 
+    def _get_pair_id(self, symbol):
+        if symbol not in self._pair_ids:
+            r = self.session.query(model.Pairs.id).filter(model.Pairs.symbol == symbol).one_or_none()
+            if r is None:
+                return None
+            self._pair_ids[symbol] = r.id
+        return self._pair_ids[symbol]
+
     def on_message(self, msg):
         if msg is not None:
+            if self.journal is not None:
+                self.journal.raw(journal.USER, msg)
             msg = json.loads(msg)
             logger.debug("Received USER message: %s" % msg)
-        if msg is not None and 'type' in msg:
+        if msg is not None and 'type' in msg and msg['type'] != 'heartbeat':
+            for listener in self.listeners:
+                try:
+                    listener(msg)
+                except Exception as e:
+                    logger.error("USER message listener failed: %s" % e, exc_info=True)
             if 'product_id' in msg:
                 product = msg.get('product_id')
                 order_id = msg.get('order_id')
@@ -42,27 +75,22 @@ class UserClient(ws.CBChannelServer, threading.Thread):
                 size = msg.get('size')
                 funds = msg.get('funds')
                 price = msg.get('price')
-                r = self.session.query(model.Pairs).filter(model.Pairs.symbol == product).one_or_none()
-                pair_id = None
-                if r is not None:
-                    pair_id = r.id
+                fill = metrics.is_fill(msg)
+                fee_rate = msg.get('taker_fee_rate', msg.get('maker_fee_rate'))
                 if msg['type'] == 'received':
                     status = 'received'
-                    if product in self.current_orders:
-                        self.current_orders[product] += [order_id]
-                    else:
-                        self.current_orders[product] = [order_id]
                 elif msg['type'] == 'match':
                     status = 'matched'
                     order_id = msg.get('taker_order_id')
                 elif msg['type'] == 'done':
                     status = msg.get('reason')
-                    if product in self.current_orders:
-                        self.current_orders[product].remove(order_id)
-                    else:
-                        logger.error("Received DONE message for an order (%s) which is not in current list" % order_id)
                 else:
                     status = 'other'
+                if self.async_db:
+                    import model.aio as aio
+                    aio.submit_write(aio.write_user_transaction(product, fill=fill, fee_rate=fee_rate, timestamp=timestamp, order_id=order_id, size=size, funds=funds, price=price, side=side, status=status, execution_id=self.execution_id), 'transaction')
+                    return
+                pair_id = self._get_pair_id(product)
                 try:
                     self.session.add(
                         model.Transaction(
@@ -73,20 +101,30 @@ class UserClient(ws.CBChannelServer, threading.Thread):
                             funds=funds,
                             price=price,
                             side=side,
-                            status=status
+                            status=status,
+                            execution_id=self.execution_id
                         )
                     )
+                    if fill and self.execution_id is not None:
+                        self.session.execute(metrics.fill_statement(self.execution_id, timestamp, size, price, fee_rate))
+                    if fill:
+                        self.session.execute(notify.notify_statement(notify.fill_event(self.execution_id, product, side, size, price, timestamp, status)))
                     self.session.commit()
                 except Exception as e:
+                    self.session.rollback()
                     logger.error("Unable to write transaction to DB: %s" % e, exc_info=True)
+                finally:
+                    # Nothing is read back, keep the identity map empty
+                    self.session.expunge_all()
 
     def on_close(self):
-        self.session.close()
+        if self.session is not None:
+            # Returns the connection to the pool, the session stays usable
+            self.session.close()
         logger.error("Lost connection to USER")
 
     def on_error(self, e):
         self.error = e
-        self.stop = True
         logger.error("There was an error with USER subscription: %s" % e)
 
 class TickerClient(ws.CBChannelServer, threading.Thread):
@@ -96,13 +134,14 @@ class TickerClient(ws.CBChannelServer, threading.Thread):
         threading.Thread.__init__(self)
         self.daemon = True
         self.last_prices = {}
+        self.last_volumes = {}
+        self.journal = None
 
     def run(self):
         self.connect()
 
     def on_open(self):
         logger.info("Connecting to TICKER channel")
-        self.session = model.connect_to_session()
         self.error = None
 
     def on_message(self, msg):
@@ -112,14 +151,16 @@ class TickerClient(ws.CBChannelServer, threading.Thread):
             if 'type' in msg and 'price' in msg and 'product_id' in msg:
                 if msg.get('product_id') is not None:
                     self.last_prices[msg.get('product_id')] = float(msg.get('price'))
+                    if msg.get('volume_24h') is not None:
+                        self.last_volumes[msg.get('product_id')] = float(msg.get('volume_24h'))
+                    if self.journal is not None:
+                        self.journal.tick(msg.get('product_id'), self.last_prices[msg.get('product_id')], self.last_volumes.get(msg.get('product_id')))
 
     def on_close(self):
         logger.error("Lost connection to TICKER")
-        self.session.close()
 
     def on_error(self, e):
         self.error = e
-        self.stop = True
         logger.error("There was an error with TICKER subscription: %s" % e)
 
 def get_rest_client(env):
@@ -138,10 +179,11 @@ def get_rest_client(env):
     b64secret = client_parameters.get('api_secret')
     passphrase = client_parameters.get('passphrase')
     api_url = client_parameters.get('rest_url')
+    import cbpro
     auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase, api_url=api_url)
     return auth_client
 
-def get_wss_client(env, products):
+def get_wss_client(env, products, execution_id=None, async_db=False, feed_shards=0, heartbeat_timeout=30, event_journal=None):
     if env == "production":
         logger.debug("Setting up WSS client in production mode...")
         with open("production.json") as json_file:
@@ -157,12 +199,35 @@ def get_wss_client(env, products):
     key = client_parameters.get('api_key')
     b64secret = client_parameters.get('api_secret')
     passphrase = client_parameters.get('passphrase')
-    ticker_wsClient = TickerClient(products)
-    user_wsClient = UserClient(products, auth=True, api_key=key, api_secret=b64secret, api_passphrase=passphrase)
+    if feed_shards > 1:
+        ticker_wsClient = ShardedTickerClient(products, shards=feed_shards, heartbeat_timeout=heartbeat_timeout)
+    else:
+        # Shard processes do not journal ticks, run() journals the price
+        # snapshot of every tick instead
+        ticker_wsClient = TickerClient(products)
+        ticker_wsClient.journal = event_journal
+    user_wsClient = UserClient(products, execution_id=execution_id, async_db=async_db, auth=True, api_key=key, api_secret=b64secret, api_passphrase=passphrase)
+    user_wsClient.journal = event_journal
     ticker_wsClient.start()
     user_wsClient.start()
     return (ticker_wsClient, user_wsClient)
 
+def get_level2_client(products):
+    level2_wsClient = Level2Client(products)
+    level2_wsClient.start()
+    return level2_wsClient
+
+def cap_order_funds(book, side, funds, max_slippage_bps, increment):
+    # Limit a market order to the liquidity resting within max_slippage_bps of
+    # the best price, rounded down to the quote increment
+    if book is None or book.updated is None:
+        return funds
+    n = len(increment.split('.')[-1]) if increment else 2
+    capped = np.floor(book.cap_funds(side, funds, max_slippage_bps) * 10 ** n) / 10 ** n
+    if capped < funds:
+        logger.debug("Capping %s order on %s from %s to %s to stay within %s bps" % (side, book.product_id, funds, capped, max_slippage_bps))
+    return capped
+
 def get_mkt_cap_key():
     logger.debug("Getting marketcap API key...")
     with open("mktcap.json") as json_file:
@@ -183,6 +248,18 @@ def get_configuration(configuration_file=None, session=None):
     universe = configuration_parameters.get('universe')
     base_currency = configuration_parameters.get('base_currency')
     configuration_parameters['portfolio_size'] = int(configuration_parameters.get('portfolio_size', 0))
+    configuration_parameters['bulk_writes'] = str(configuration_parameters.get('bulk_writes', False)).lower() == 'true'
+    configuration_parameters['async_db'] = str(configuration_parameters.get('async_db', False)).lower() == 'true'
+    configuration_parameters['feed_shards'] = int(configuration_parameters.get('feed_shards', 0))
+    configuration_parameters['max_slippage_bps'] = float(configuration_parameters.get('max_slippage_bps', 0))
+    configuration_parameters['execution_slices'] = int(configuration_parameters.get('execution_slices', 1))
+    configuration_parameters['execution_duration'] = float(configuration_parameters.get('execution_duration', configuration_parameters.get('timestep', 0)))
+    configuration_parameters['participation_rate'] = float(configuration_parameters.get('participation_rate', 0))
+    configuration_parameters['weighting'] = configuration_parameters.get('weighting', 'equal')
+    configuration_parameters['volatility_window'] = int(configuration_parameters.get('volatility_window', 360))
+    configuration_parameters['heartbeat_timeout'] = float(configuration_parameters.get('heartbeat_timeout', 30))
+    configuration_parameters['journal_path'] = configuration_parameters.get('journal_path', journal.JOURNAL_PATH)
+    configuration_parameters['order_max_age'] = float(configuration_parameters.get('order_max_age', 86400))
     product_pairs = {c: c + '-' + base_currency for c in universe}
     configuration_parameters['product_pairs'] = product_pairs
     try:
@@ -222,61 +299,6 @@ def write_pairs(product_pairs, session=None):
     if close_session:
         session.close()
 
-def write_amount(timestamp, amount, execution_id, session=None):
-    close_session = False
-    if session is None:
-        session = model.connect_to_session()
-    try:
-        session.add(model.PortfolioValue(timestamp=timestamp, value=amount, execution_id=execution_id))
-    except Exception as e:
-        logger.error("Unable to write amount to DB: %s" % e, exc_info=True)
-    else:
-        session.commit()
-    if close_session:
-        session.close()
-
-def write_positions(timestamp, positions, execution_id, session=None):
-    close_session = False
-    if session is None:
-        session = model.connect_to_session()
-    try:
-        session.add_all([model.Positions(timestamp=timestamp, symbol=c, value=v, execution_id=execution_id) for c, v in positions.items()])
-    except Exception as e:
-        logger.error("Unable to write positions to DB: %s" % e, exc_info=True)
-    else:
-        session.commit()
-    if close_session:
-        session.close()
-
-def write_submitted_order(submitted_order, execution_id, session=None):
-    close_session = False
-    if session is None:
-        session = model.connect_to_session()
-
-    r = session.query(model.Pairs).filter(model.Pairs.symbol == submitted_order.get('product_id')).one_or_none()
-    pair_id = None
-    if r is not None:
-        pair_id = r.id
-    try:
-        session.add(
-            model.Transaction(
-                timestamp=submitted_order.get('created_at'),
-                order_id=submitted_order.get('id'),
-                pair_id=pair_id,
-                size=submitted_order.get('size'),
-                funds=submitted_order.get('funds'),
-                price=None,
-                side=submitted_order.get('side'),
-                status=submitted_order.get('status'),
-                execution_id=execution_id
-            )
-        )
-        session.commit()
-    except Exception as e:
-        logger.error("Unable to write transaction to DB: %s" % e, exc_info=True)
-    if close_session:
-        session.close()
-
 def initialize_prices(wsClient, universe):
     #Initialize prices
     t0 = time.time()
@@ -301,16 +323,6 @@ def create_orders(target_positions, current_positions, universe, min_increments)
     orders.sort()
     return orders
 
-def get_target_weights(universe, market_caps, base_weight, portfolio_size, portfolio_rank='LARGE'):
-    current_caps = [(market_caps.get(c).get('rank'), c) for c in universe if c in market_caps]
-    current_caps.sort()
-    if portfolio_rank.upper() == 'SMALL':
-        current_selection = [v[-1] for v in current_caps[-portfolio_size:]]
-    else:
-        current_selection = [v[-1] for v in current_caps[:portfolio_size]]
-    target_weights = {c: (1 - base_weight) / portfolio_size if c in current_selection else 0 for c in universe}
-    return target_weights
-
 def run(env, configuration_file=None):
     session = model.connect_to_session()
     auth_client = get_rest_client(env)
@@ -325,28 +337,71 @@ def run(env, configuration_file=None):
     portfolio_size = configuration_parameters['portfolio_size']
     portfolio_rank = configuration_parameters.get('portfolio_rank', 'large')
     write_pairs(product_pairs, session=session)
-    ticker_wsClient, user_wsClient = get_wss_client(env, list(product_pairs.values()))
+    ensure_partitions(session)
+    event_journal = None
+    if configuration_parameters['journal_path']:
+        event_journal = journal.Journal(journal.new_journal_path(configuration_parameters['execution_name'], configuration_parameters['journal_path']))
+        event_journal.event(journal.CONFIGURATION, configuration_parameters)
+        logger.info("Journaling events to %s" % event_journal.path)
+    tick_writer = TickWriter(session, execution_id, bulk=configuration_parameters['bulk_writes'], asynchronous=configuration_parameters['async_db'])
+    ticker_wsClient, user_wsClient = get_wss_client(env, list(product_pairs.values()), execution_id=execution_id, async_db=configuration_parameters['async_db'], feed_shards=configuration_parameters['feed_shards'], heartbeat_timeout=configuration_parameters['heartbeat_timeout'], event_journal=event_journal)
+    level2_wsClient = None
+    if configuration_parameters['max_slippage_bps'] > 0:
+        level2_wsClient = get_level2_client(list(product_pairs.values()))
+    supervisor = None
+    if configuration_parameters['heartbeat_timeout'] > 0:
+        supervisor = ConnectionSupervisor([ticker_wsClient, user_wsClient, level2_wsClient], timeout=configuration_parameters['heartbeat_timeout'])
+        supervisor.start()
+    scheduler = None
+    if configuration_parameters['execution_slices'] > 1 and user_wsClient is not None:
+        scheduler = ExecutionScheduler(
+            auth_client,
+            configuration_parameters['execution_slices'],
+            configuration_parameters['execution_duration'],
+            participation_rate=configuration_parameters['participation_rate'],
+            ticker=ticker_wsClient,
+            cap=None if level2_wsClient is None else
+                lambda product_id, side, funds, increment: cap_order_funds(level2_wsClient.books.get(product_id), side, funds, configuration_parameters['max_slippage_bps'], increment))
+        user_wsClient.listeners.append(scheduler.on_user_message)
+        scheduler.start()
     has_prices = initialize_prices(ticker_wsClient, configuration_parameters['universe'])
     if has_prices and ticker_wsClient is not None and user_wsClient is not None and auth_client is not None:
-        orders_submitted = {}
+        # Scheduler children are only submitted at the end of a tick, so
+        # their early messages are held for up to two ticks
+        order_tracker = OrderTracker(max_age=configuration_parameters['order_max_age'], early_ttl=max(60, 2 * timestep))
+        user_wsClient.listeners.append(order_tracker.on_user_message)
+        valuation = Valuation(universe + [base_currency], base_currency, list(product_pairs.values()))
+        volatility = RollingVolatility(window=configuration_parameters['volatility_window'])
+        weighting = WeightingEngine(universe, base_weight, portfolio_size, portfolio_rank=portfolio_rank, strategy=configuration_parameters['weighting'], volatility=volatility)
         while True:
             orders = {}
             try:
                 market_caps = get_market_cap(mkt_cap_key)
-                target_weights = get_target_weights(universe, market_caps, base_weight, portfolio_size, portfolio_rank=portfolio_rank)
+                # One snapshot of the feed per tick, so the journal holds
+                # exactly the prices the decisions were made on
+                last_prices = dict(ticker_wsClient.last_prices)
+                volatility.update({c: last_prices.get(p) for c, p in product_pairs.items()})
+                target_weights = weighting.target_weights(market_caps)
                 product_info = auth_client.get_products()
                 min_increment = {p.get('base_currency'): p.get('quote_increment', '') for p in product_info if (p.get('quote_currency') == base_currency and p.get('id') in product_pairs.values())}
+                min_funds = {p.get('base_currency'): float(p.get('min_market_funds') or 0) for p in product_info if (p.get('quote_currency') == base_currency and p.get('id') in product_pairs.values())}
                 accounts = auth_client.get_accounts()
-                current_orders = {c: sum([f for i, f in v.items() if i in user_wsClient.current_orders.get(c, [])]) for c, v in orders_submitted.items()}
+                if event_journal is not None:
+                    event_journal.event(journal.MARKET_CAPS, market_caps)
+                    event_journal.event(journal.PRICES, last_prices)
+                    event_journal.rest('get_products', [p for p in product_info if p.get('id') in product_pairs.values()])
+                    event_journal.rest('get_accounts', accounts)
+                    event_journal.event(journal.WEIGHTS, target_weights)
+                order_tracker.expire()
+                current_orders = order_tracker.open_funds()
                 logger.debug("Current orders = %s" % current_orders)
-                logger.debug("Current prices = %s" % ticker_wsClient.last_prices)
+                logger.debug("Current prices = %s" % last_prices)
                 current_positions = {acc.get('currency'): float(acc.get('balance')) for acc in accounts if acc.get('currency') in universe + [base_currency]}
-                # write_positions(auth_client.get_time().get('iso'), current_positions, execution_id, session=session)
-                current_positions = {c: ticker_wsClient.last_prices.get(product_pairs.get(c), np.nan) * v if c != base_currency else v for c, v in current_positions.items()}
+                current_positions = valuation.value(current_positions, last_prices)
                 logger.debug("Current positions = %s" % current_positions)
                 amount = sum(current_positions.values())
                 logger.debug("Total amount=%s" % amount)
-                write_amount(auth_client.get_time().get('iso'), amount, execution_id, session=session)
+                tick_writer.add_amount(auth_client.get_time().get('iso'), amount)
                 current_weights = {}
                 if not np.isnan(amount) and amount != 0:
                     current_weights = {c: v / amount for c, v in current_positions.items() if c in universe}
@@ -361,8 +416,12 @@ def run(env, configuration_file=None):
                 else:
                     orders = create_orders(target_positions, current_positions, universe, min_increment)
                 logger.debug("Current orders = %s" % orders)
+                if event_journal is not None:
+                    event_journal.event(journal.POSITIONS, current_positions)
+                    event_journal.event(journal.ORDERS, orders)
             except Exception as e:
                 logger.error("Error computing orders: %s" % e, exc_info=True)
+                tick_writer.commit()
                 break
             try:
                 for v, c in orders:
@@ -370,25 +429,50 @@ def run(env, configuration_file=None):
                         trading_pair = product_pairs.get(c)
                         side = 'buy' if v > 0 else 'sell'
                         funds = abs(v)
+                        if scheduler is not None:
+                            # Each child is capped to the book when placed
+                            if scheduler.is_active(trading_pair):
+                                logger.debug("Execution still running for %s, skipping order" % trading_pair)
+                            else:
+                                scheduler.submit(trading_pair, side, funds, increment=min_increment.get(c, ''), min_funds=min_funds.get(c, 0))
+                            continue
+                        if level2_wsClient is not None:
+                            funds = cap_order_funds(level2_wsClient.books.get(trading_pair), side, funds, configuration_parameters['max_slippage_bps'], min_increment.get(c, ''))
+                            if funds <= 0:
+                                continue
                         logger.debug("Placing %s order of %s %s for %s" % (side, funds, base_currency, trading_pair))
                         r = auth_client.place_market_order(product_id=trading_pair, 
                                side=side, 
                                funds=funds)
-                        if 'status' in r and r['status'] == 'pending' and 'id' in r and 'product_id' in r:
-                            if r['product_id'] in orders_submitted:
-                                orders_submitted[r['product_id']].update({r['id']: r['funds']})
-                            else:
-                                orders_submitted[r['product_id']] = {r['id']: r['funds']}
-                            write_submitted_order(r, execution_id, session=session)
-                            logger.debug("Submitted orders for %s are now: %s" % (r['product_id'], orders_submitted[r['product_id']]))
+                        if event_journal is not None:
+                            event_journal.rest('place_market_order', r, request={'product_id': trading_pair, 'side': side, 'funds': funds})
+                        if order_tracker.submit(r):
+                            tick_writer.add_submitted_order(r)
                         logger.debug("Response is: %s" % r)
                 current_positions = {acc.get('currency'): float(acc.get('balance')) for acc in accounts if acc.get('currency') in universe + [base_currency]}
-                write_positions(auth_client.get_time().get('iso'), current_positions, execution_id, session=session)
+                tick_writer.add_positions(auth_client.get_time().get('iso'), current_positions)
             except Exception as e:
                 logger.error("Error sending orders: %s" % e, exc_info=True)
+            if scheduler is not None:
+                for r in scheduler.drain_submitted():
+                    if event_journal is not None:
+                        event_journal.rest('place_market_order', r)
+                    if order_tracker.submit(r):
+                        tick_writer.add_submitted_order(r)
+            tick_writer.commit()
+            if event_journal is not None:
+                event_journal.flush()
             time.sleep(timestep)
         ticker_wsClient.close()
         user_wsClient.close()
+        if level2_wsClient is not None:
+            level2_wsClient.close()
+        if scheduler is not None:
+            scheduler.close()
+    if supervisor is not None:
+        supervisor.close()
+    if event_journal is not None:
+        event_journal.close()
     session.close()
 
     if __name__ == "__main__":
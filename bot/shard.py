@@ -0,0 +1,162 @@
+import multiprocessing
+import json
+import math
+import time
+import logging
+from . import ws
+from .supervisor import ConnectionSupervisor
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Sharded ticker feed: product ids are partitioned across worker processes,
+# each with its own websocket connection and JSON decoding. Workers write the
+# latest price and 24h volume of their pairs into shared memory arrays, so
+# the parent's merged view is a plain read with no message passing.
+
+class ShardTickerServer(ws.CBChannelServer):
+
+    def __init__(self, pairs, index, prices, volumes, updates, **kwargs):
+        ws.CBChannelServer.__init__(self, pairs, 'ticker', **kwargs)
+        self.index = index
+        self.prices = prices
+        self.volumes = volumes
+        self.updates = updates
+
+    def on_message(self, msg):
+        if msg is not None:
+            msg = json.loads(msg)
+            i = self.index.get(msg.get('product_id'))
+            if i is not None and 'price' in msg:
+                self.prices[i] = float(msg['price'])
+                if msg.get('volume_24h') is not None:
+                    self.volumes[i] = float(msg['volume_24h'])
+                self.updates[i] += 1
+
+def _run_shard(pairs, index, prices, volumes, updates, heartbeat_timeout, kwargs):
+    server = ShardTickerServer(pairs, index, prices, volumes, updates, **kwargs)
+    if heartbeat_timeout > 0:
+        ConnectionSupervisor([server], timeout=heartbeat_timeout).start()
+    server.connect()
+
+class ShardedTickerClient(object):
+
+    def __init__(self, pairs, shards=None, heartbeat_timeout=30, **kwargs):
+        self.pairs = list(pairs)
+        self.shards = max(1, min(shards or multiprocessing.cpu_count(), len(self.pairs)))
+        self.index = {p: i for i, p in enumerate(self.pairs)}
+        self.prices = multiprocessing.Array('d', [math.nan] * len(self.pairs), lock=False)
+        self.volumes = multiprocessing.Array('d', [math.nan] * len(self.pairs), lock=False)
+        self.updates = multiprocessing.Array('L', len(self.pairs), lock=False)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.kwargs = kwargs
+        self.processes = []
+
+    def shard_pairs(self, k):
+        return self.pairs[k::self.shards]
+
+    def _start_shard(self, k):
+        pairs = self.shard_pairs(k)
+        p = multiprocessing.Process(
+            target=_run_shard,
+            args=(pairs, {c: self.index[c] for c in pairs}, self.prices, self.volumes, self.updates, self.heartbeat_timeout, self.kwargs),
+            name='ticker-shard-%s' % k,
+            daemon=True)
+        p.start()
+        return p
+
+    def start(self):
+        self.processes = [self._start_shard(k) for k in range(self.shards)]
+        logger.info("Started %s ticker shards for %s pairs" % (self.shards, len(self.pairs)))
+
+    @property
+    def last_prices(self):
+        prices = self.prices[:]
+        return {c: prices[i] for c, i in self.index.items() if not math.isnan(prices[i])}
+
+    @property
+    def last_volumes(self):
+        volumes = self.volumes[:]
+        return {c: volumes[i] for c, i in self.index.items() if not math.isnan(volumes[i])}
+
+    def is_alive(self):
+        return all(p.is_alive() for p in self.processes)
+
+    def check_health(self, timeout):
+        # Each shard supervises its own connection; here dead shards are
+        # replaced by a fresh process
+        healthy = True
+        for k, p in enumerate(self.processes):
+            if not p.is_alive():
+                logger.warning("Ticker shard %s exited with code %s, restarting" % (k, p.exitcode))
+                self.processes[k] = self._start_shard(k)
+                healthy = False
+        return healthy
+
+    def close(self):
+        logger.debug("Closing ticker shards...")
+        for p in self.processes:
+            p.terminate()
+        for p in self.processes:
+            p.join()
+        self.processes = []
+
+def _ticker_messages(pairs, n):
+    return [json.dumps({
+        'type': 'ticker',
+        'sequence': i,
+        'product_id': pairs[i % len(pairs)],
+        'price': '%.8f' % (1 + (i % 1000) * 1e-5),
+        'open_24h': '1.00000000',
+        'volume_24h': '12345.67890000',
+        'low_24h': '0.90000000',
+        'high_24h': '1.10000000',
+        'volume_30d': '345678.90000000',
+        'best_bid': '0.99990000',
+        'best_ask': '1.00010000',
+        'side': 'buy',
+        'time': '2021-10-20T00:00:00.000000Z',
+        'trade_id': i,
+        'last_size': '0.10000000'
+    }) for i in range(n)]
+
+def _run_benchmark_shard(pairs, index, prices, volumes, updates, n, ready, go):
+    messages = _ticker_messages(pairs, n)
+    server = ShardTickerServer(pairs, index, prices, volumes, updates)
+    ready.set()
+    go.wait()
+    for msg in messages:
+        server.on_message(msg)
+
+def benchmark(n_pairs=200, messages=400000, shards=None):
+    if shards is None:
+        shards = sorted({1, 2, 4, multiprocessing.cpu_count()})
+    pairs = ['C%s-BTC' % i for i in range(n_pairs)]
+    results = {}
+    for n in shards:
+        client = ShardedTickerClient(pairs, shards=n)
+        go = multiprocessing.Event()
+        events = []
+        processes = []
+        for k in range(client.shards):
+            shard = client.shard_pairs(k)
+            ready = multiprocessing.Event()
+            p = multiprocessing.Process(
+                target=_run_benchmark_shard,
+                args=(shard, {c: client.index[c] for c in shard}, client.prices, client.volumes, client.updates, messages // client.shards, ready, go))
+            p.start()
+            events.append(ready)
+            processes.append(p)
+        for ready in events:
+            ready.wait()
+        t0 = time.perf_counter()
+        go.set()
+        for p in processes:
+            p.join()
+        elapsed = time.perf_counter() - t0
+        results[client.shards] = sum(client.updates[:]) / elapsed
+    return results
+
+if __name__ == "__main__":
+    for n, rate in benchmark().items():
+        print("%s shards: %.0f messages/s" % (n, rate))
@@ -0,0 +1,44 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class ConnectionSupervisor(threading.Thread):
+    # Watches channel clients from a single thread. Every `interval` seconds
+    # each client's check_health(timeout) is called; a client that has seen
+    # no message, heartbeats included, for `timeout` seconds drops its
+    # connection and reconnects with backoff instead of hanging until the
+    # TCP connection times out.
+
+    def __init__(self, clients, timeout=30, interval=5):
+        threading.Thread.__init__(self, name='connection-supervisor')
+        self.daemon = True
+        self.clients = [c for c in clients if c is not None]
+        self.timeout = timeout
+        self.interval = interval
+        self.unhealthy = {}
+        self._stop_event = threading.Event()
+
+    def add(self, client):
+        if client is not None:
+            self.clients.append(client)
+
+    def check(self):
+        for client in self.clients:
+            try:
+                healthy = client.check_health(self.timeout)
+            except Exception as e:
+                logger.error("Unable to check connection health of %s: %s" % (client, e), exc_info=True)
+                continue
+            name = '/'.join(getattr(client, 'channels', [type(client).__name__]))
+            if not healthy:
+                self.unhealthy[name] = self.unhealthy.get(name, 0) + 1
+                logger.warning("Connection %s was unhealthy, recovering (%s times so far)" % (name, self.unhealthy[name]))
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.check()
+
+    def close(self):
+        self._stop_event.set()
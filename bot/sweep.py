@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import uuid
+import datetime
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .weights import WeightingEngine, RollingVolatility
+from .valuation import Valuation
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Offline parameter sweeps of the run() rebalancing logic. Price history lives
+# in .npy files that every worker memory-maps, so the pool shares one copy in
+# the page cache. Each step goes through the same WeightingEngine, Valuation
+# and create_orders as run(), so sweep executions compare with live ones.
+
+HISTORY_PATH = 'history'
+SWEEP_PARAMETERS = ('base_weight', 'portfolio_size', 'portfolio_rank', 'timestep', 'weighting', 'volatility_window', 'fee_rate', 'min_order', 'initial_value')
+
+_history = {}
+
+def fetch_history(universe, base_currency, days=30, granularity=300, path=HISTORY_PATH):
+    # Close prices from Coinbase candles on a common time grid, gaps forward filled
+    import cbpro
+    client = cbpro.PublicClient()
+    end = datetime.datetime.utcnow().replace(microsecond=0)
+    start = end - datetime.timedelta(days=days)
+    step = datetime.timedelta(seconds=granularity * 300)
+    closes = {}
+    for c in universe:
+        closes[c] = {}
+        t = start
+        while t < end:
+            candles = client.get_product_historic_rates(c + '-' + base_currency, start=t.isoformat(), end=min(t + step, end).isoformat(), granularity=granularity)
+            if isinstance(candles, list):
+                closes[c].update({row[0]: row[4] for row in candles})
+            else:
+                logger.error("Unable to get candles for %s: %s" % (c, candles))
+            t += step
+            time.sleep(0.35)
+    times = np.array(sorted(set().union(*[set(v) for v in closes.values()])), dtype=np.int64)
+    prices = np.full((len(times), len(universe)), np.nan)
+    for j, c in enumerate(universe):
+        last = np.nan
+        for i, t in enumerate(times):
+            last = closes[c].get(t, last)
+            prices[i, j] = last
+    # Order rules the simulation applies as the exchange would
+    products = {p.get('base_currency'): p for p in client.get_products() if p.get('quote_currency') == base_currency}
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'prices.npy'), prices)
+    np.save(os.path.join(path, 'times.npy'), times)
+    with open(os.path.join(path, 'meta.json'), 'w') as json_file:
+        json.dump({
+            'universe': universe,
+            'base_currency': base_currency,
+            'granularity': granularity,
+            'quote_increment': {c: products[c].get('quote_increment', '') for c in universe if c in products},
+            'min_market_funds': {c: float(products[c].get('min_market_funds') or 0) for c in universe if c in products}
+        }, json_file)
+    return prices, times
+
+def save_market_caps(market_caps, universe, path=HISTORY_PATH):
+    # A single rank/cap snapshot taken at the end of the history, see
+    # _market_caps_at for how it is carried back over the steps
+    np.save(os.path.join(path, 'ranks.npy'), np.array([market_caps.get(c, {}).get('rank') or np.nan for c in universe], dtype=float))
+    np.save(os.path.join(path, 'caps.npy'), np.array([market_caps.get(c, {}).get('market_cap') or np.nan for c in universe], dtype=float))
+
+def load_history(path=HISTORY_PATH):
+    with open(os.path.join(path, 'meta.json')) as json_file:
+        history = json.load(json_file)
+    for name in ['prices', 'times', 'ranks', 'caps']:
+        f = os.path.join(path, name + '.npy')
+        history[name] = np.load(f, mmap_mode='r') if os.path.exists(f) else None
+    return history
+
+def _init_worker(path):
+    _history.update(load_history(path))
+
+def expand_grid(grid):
+    keys = sorted(grid)
+    for values in itertools.product(*[grid[k] if isinstance(grid[k], list) else [grid[k]] for k in keys]):
+        yield dict(zip(keys, values))
+
+def _market_caps(universe, ranks, caps):
+    if ranks is None:
+        return {c: {'rank': i + 1, 'market_cap': None} for i, c in enumerate(universe)}
+    return {c: {'rank': ranks[i], 'market_cap': None if caps is None or np.isnan(caps[i]) else caps[i]} for i, c in enumerate(universe) if not np.isnan(ranks[i])}
+
+def _market_caps_at(universe, ranks, caps, prices, i):
+    # Market caps as run() would have fetched them at step i. Per step
+    # arrays (2-D) are used as they are. A snapshot is moved back with each
+    # coin's price, assuming constant supply, and the snapshot ranks of the
+    # coins with a cap are handed out again in order of those caps
+    if ranks is not None and ranks.ndim == 2:
+        ranks = ranks[i]
+    if caps is not None and caps.ndim == 2:
+        caps = caps[i]
+    elif caps is not None:
+        caps = caps * prices[i] / prices[-1]
+        if ranks is not None:
+            ranks = np.array(ranks, dtype=float)
+            known = np.flatnonzero(~np.isnan(caps) & ~np.isnan(ranks))
+            ranks[known[np.argsort(-caps[known], kind='stable')]] = np.sort(ranks[known])
+    return _market_caps(universe, ranks, caps)
+
+def simulate(parameters, history=None):
+    # Replays run() over the history: every timestep value the holdings, get
+    # target weights from a WeightingEngine fed that step's caps and prices,
+    # build the orders with create_orders and fill, at the close price, the
+    # ones the exchange would accept (at least min_market_funds, enough
+    # balance). Fees come out of the order funds.
+    from .robot import create_orders
+    if history is None:
+        history = _history
+    universe = history['universe']
+    base_currency = history['base_currency']
+    granularity = history['granularity']
+    step = max(1, int(float(parameters.get('timestep', granularity))) // granularity)
+    all_prices = history['prices']
+    rows = range(0, len(all_prices), step)
+    fee_rate = float(parameters.get('fee_rate', 0.005))
+    min_order = float(parameters.get('min_order', 0.0001))
+    initial_value = float(parameters.get('initial_value', 1.0))
+    min_increment = history.get('quote_increment') or {}
+    min_funds = {c: (history.get('min_market_funds') or {}).get(c, min_order) for c in universe}
+    product_pairs = {c: c + '-' + base_currency for c in universe}
+    valuation = Valuation(universe + [base_currency], base_currency, list(product_pairs.values()))
+    volatility = RollingVolatility(window=int(parameters.get('volatility_window', 360)))
+    engine = WeightingEngine(universe, float(parameters.get('base_weight', 0.1)), int(parameters.get('portfolio_size', len(universe))),
+        portfolio_rank=parameters.get('portfolio_rank', 'LARGE'), strategy=parameters.get('weighting', 'equal'), volatility=volatility)
+    balances = {c: 0.0 for c in universe}
+    balances[base_currency] = initial_value
+    value = initial_value
+    peak = initial_value
+    max_drawdown = 0.0
+    turnover = 0.0
+    fees = 0.0
+    trades = 0
+    for i in rows:
+        p = all_prices[i]
+        last_prices = {product_pairs[c]: float(p[j]) for j, c in enumerate(universe) if not np.isnan(p[j])}
+        volatility.update({c: last_prices.get(pair) for c, pair in product_pairs.items()})
+        market_caps = _market_caps_at(universe, history.get('ranks'), history.get('caps'), all_prices, i)
+        target_weights = engine.target_weights(market_caps)
+        current_positions = valuation.value(balances, last_prices)
+        amount = sum(current_positions.values())
+        if not np.isnan(amount):
+            value = amount
+            peak = max(peak, value)
+            max_drawdown = max(max_drawdown, 1 - value / peak)
+        if len(market_caps) < 1:
+            continue
+        target_positions = {c: amount * target_weights.get(c, np.nan) for c in universe}
+        for v, c in create_orders(target_positions, current_positions, universe, min_increment):
+            if np.isnan(v) or v == 0:
+                continue
+            funds = abs(v)
+            price = last_prices.get(product_pairs[c])
+            if funds < min_funds[c] or price is None:
+                continue
+            if v > 0:
+                if funds > balances[base_currency]:
+                    continue
+                balances[base_currency] -= funds
+                balances[c] += funds * (1 - fee_rate) / price
+            else:
+                if funds / price > balances[c]:
+                    continue
+                balances[c] -= funds / price
+                balances[base_currency] += funds * (1 - fee_rate)
+            turnover += funds
+            fees += funds * fee_rate
+            trades += 1
+    return {
+        'value': float(value),
+        'pnl': float(value - initial_value),
+        'peak': float(peak),
+        'drawdown': float(1 - value / peak),
+        'max_drawdown': float(max_drawdown),
+        'turnover': float(turnover),
+        'fees': float(fees),
+        'trades': trades,
+        'steps': len(rows)
+    }
+
+def _simulate_point(args):
+    i, parameters = args
+    return i, parameters, simulate(parameters)
+
+def run_sweep(grid, path=HISTORY_PATH, workers=None, chunksize=8):
+    unknown = set(grid) - set(SWEEP_PARAMETERS)
+    if unknown:
+        logger.warning("Ignoring unknown sweep parameters %s" % sorted(unknown))
+    points = list(expand_grid({k: v for k, v in grid.items() if k in SWEEP_PARAMETERS}))
+    results = [None] * len(points)
+    t0 = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(path,)) as executor:
+        for i, parameters, result in executor.map(_simulate_point, enumerate(points), chunksize=chunksize):
+            results[i] = (parameters, result)
+    logger.info("Simulated %s configurations in %.1fs" % (len(points), time.time() - t0))
+    return results
+
+def write_results(results, name, session):
+    import model.db as model
+    timestamp = datetime.datetime.utcnow()
+    for i, (parameters, result) in enumerate(results):
+        execution = model.Execution(parameters=dict(parameters, sweep=name, results=result), name='%s-%04d' % (name, i))
+        session.add(execution)
+        session.flush()
+        session.add(model.ExecutionMetrics(
+            execution_id=execution.id,
+            timestamp=timestamp,
+            initial_value=float(parameters.get('initial_value', 1.0)),
+            value=result['value'],
+            peak_value=result['peak'],
+            pnl=result['pnl'],
+            drawdown=result['drawdown'],
+            max_drawdown=result['max_drawdown'],
+            turnover=result['turnover'],
+            fees=result['fees'],
+            fills=result['trades']))
+    session.commit()
+
+def new_sweep_name():
+    return 'sweep-%s' % uuid.uuid4().hex[:8]
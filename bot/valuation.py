@@ -0,0 +1,74 @@
+import functools
+import numpy as np
+
+class Valuation(object):
+    # Values positions in the base currency. Pairs are parsed once into a route
+    # per asset of at most two legs (pair index, exponent): a direct X-BASE
+    # pair, an inverted BASE-X pair, or a cross rate through a common quote.
+    # Valuing is then a gather and a multiply over NumPy arrays.
+
+    def __init__(self, assets, base_currency, pairs):
+        self.assets = list(assets)
+        self.base_currency = base_currency
+        self.pairs = list(pairs)
+        self.asset_index = {a: i for i, a in enumerate(self.assets)}
+        self.pair_index = {p: i for i, p in enumerate(self.pairs)}
+        n = len(self.pairs)
+        # Two sentinel slots are appended to every price vector: 1.0 for an
+        # unused leg and NaN for an asset with no route
+        self._one = n
+        self._nan = n + 1
+        legs = [self._route(a) for a in self.assets]
+        self.leg1 = np.array([l[0][0] for l in legs], dtype=np.intp)
+        self.exp1 = np.array([l[0][1] for l in legs], dtype=float)
+        self.leg2 = np.array([l[1][0] for l in legs], dtype=np.intp)
+        self.exp2 = np.array([l[1][1] for l in legs], dtype=float)
+
+    def _pair(self, base, quote):
+        return self.pair_index.get(base + '-' + quote)
+
+    def _route(self, asset):
+        one = (self._one, 1.0)
+        if asset == self.base_currency:
+            return one, one
+        if self._pair(asset, self.base_currency) is not None:
+            return (self._pair(asset, self.base_currency), 1.0), one
+        if self._pair(self.base_currency, asset) is not None:
+            return (self._pair(self.base_currency, asset), -1.0), one
+        quotes = {p.split('-', 1)[1] for p in self.pairs if p.split('-', 1)[0] == asset}
+        bases = {p.split('-', 1)[0] for p in self.pairs if p.split('-', 1)[1] == asset}
+        for q in sorted(quotes | bases):
+            if q in quotes:
+                first = (self._pair(asset, q), 1.0)
+            else:
+                first = (self._pair(q, asset), -1.0)
+            if self._pair(q, self.base_currency) is not None:
+                return first, (self._pair(q, self.base_currency), 1.0)
+            if self._pair(self.base_currency, q) is not None:
+                return first, (self._pair(self.base_currency, q), -1.0)
+        return (self._nan, 1.0), one
+
+    def price_vector(self, last_prices):
+        prices = np.empty(len(self.pairs) + 2)
+        prices[:len(self.pairs)] = [last_prices.get(p, np.nan) for p in self.pairs]
+        prices[self._one] = 1.0
+        prices[self._nan] = np.nan
+        return prices
+
+    def position_vector(self, positions):
+        return np.array([positions.get(a, 0.0) for a in self.assets], dtype=float)
+
+    def rates(self, prices):
+        return prices[self.leg1] ** self.exp1 * prices[self.leg2] ** self.exp2
+
+    def values(self, positions, prices):
+        return positions * self.rates(prices)
+
+    def value(self, positions, last_prices):
+        # Convenience wrapper for dicts: asset -> value in base currency
+        values = self.values(self.position_vector(positions), self.price_vector(last_prices))
+        return {a: float(values[self.asset_index[a]]) for a in positions if a in self.asset_index}
+
+@functools.lru_cache(maxsize=32)
+def get_valuation(assets, base_currency, pairs):
+    return Valuation(assets, base_currency, pairs)
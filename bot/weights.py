@@ -0,0 +1,141 @@
+import math
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+STRATEGIES = ('equal', 'market_cap', 'sqrt_cap', 'inverse_vol')
+
+class RollingStat(object):
+    # Running mean/variance over the last `window` samples, O(1) per update.
+    # Sums are rebuilt once per window to stop floating point drift.
+
+    __slots__ = ('window', 'values', 'total', 'total_sq', 'updates')
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque(maxlen=window)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.updates = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def push(self, x):
+        if len(self.values) == self.window:
+            old = self.values[0]
+            self.total -= old
+            self.total_sq -= old * old
+        self.values.append(x)
+        self.total += x
+        self.total_sq += x * x
+        self.updates += 1
+        if self.updates % self.window == 0:
+            self.total = math.fsum(self.values)
+            self.total_sq = math.fsum(v * v for v in self.values)
+
+    def std(self):
+        n = len(self.values)
+        if n < 2:
+            return math.nan
+        var = (self.total_sq - self.total * self.total / n) / (n - 1)
+        return math.sqrt(max(var, 0.0))
+
+class RollingVolatility(object):
+    # Volatility of per-tick log returns for each asset
+
+    def __init__(self, window=360):
+        self.window = window
+        self.last_prices = {}
+        self.returns = {}
+
+    def update(self, prices):
+        for asset, price in prices.items():
+            if price is None or not price > 0:
+                continue
+            last = self.last_prices.get(asset)
+            if last is not None:
+                if asset not in self.returns:
+                    self.returns[asset] = RollingStat(self.window)
+                self.returns[asset].push(math.log(price / last))
+            self.last_prices[asset] = price
+
+    def volatility(self, asset):
+        stat = self.returns.get(asset)
+        if stat is None:
+            return math.nan
+        return stat.std()
+
+class WeightingEngine(object):
+    # Target weights for the top (LARGE) or bottom (SMALL) portfolio_size
+    # market cap ranks of the universe. The selection (and equal weights) is
+    # memoized on the ranks alone, which rarely move between ticks, so an
+    # unchanged ranking costs a key comparison instead of a sort. Cap-based
+    # weights also depend on the live caps of the selection and are
+    # recomputed when those change; inverse volatility is recomputed over the
+    # selection only.
+
+    def __init__(self, universe, base_weight, portfolio_size, portfolio_rank='LARGE', strategy='equal', volatility=None):
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown weighting strategy %s, expected one of %s" % (strategy, ', '.join(STRATEGIES)))
+        self.universe = list(universe)
+        self.base_weight = base_weight
+        self.portfolio_size = portfolio_size
+        self.portfolio_rank = portfolio_rank
+        self.strategy = strategy
+        self.volatility = volatility
+        self._version = None
+        self._cap_version = None
+        self._selection = []
+        self._weights = {}
+
+    def snapshot_version(self, market_caps):
+        return tuple((c, market_caps[c].get('rank')) for c in self.universe if c in market_caps)
+
+    def cap_version(self, market_caps):
+        return tuple(market_caps[c].get('market_cap') for c in self._selection)
+
+    def _select(self, market_caps):
+        current_caps = [(market_caps.get(c).get('rank'), c) for c in self.universe if c in market_caps]
+        current_caps.sort()
+        if self.portfolio_rank.upper() == 'SMALL':
+            return [v[-1] for v in current_caps[-self.portfolio_size:]]
+        return [v[-1] for v in current_caps[:self.portfolio_size]]
+
+    def _normalize(self, raw):
+        total = sum(raw.values())
+        if not total > 0 or any(math.isnan(v) for v in raw.values()):
+            return self._equal()
+        return {c: (1 - self.base_weight) * raw.get(c, 0) / total if c in raw else 0 for c in self.universe}
+
+    def _equal(self):
+        return {c: (1 - self.base_weight) / self.portfolio_size if c in self._selection else 0 for c in self.universe}
+
+    def _cap_weights(self, market_caps, transform):
+        caps = {c: market_caps[c].get('market_cap') for c in self._selection}
+        if any(v is None for v in caps.values()):
+            logger.debug("Missing market caps for %s, falling back to equal weights" % [c for c, v in caps.items() if v is None])
+            return self._equal()
+        return self._normalize({c: transform(float(v)) for c, v in caps.items()})
+
+    def target_weights(self, market_caps):
+        version = self.snapshot_version(market_caps)
+        if version != self._version:
+            self._version = version
+            self._cap_version = None
+            self._selection = self._select(market_caps)
+            if self.strategy not in ('market_cap', 'sqrt_cap'):
+                self._weights = self._equal()
+        if self.strategy in ('market_cap', 'sqrt_cap'):
+            cap_version = self.cap_version(market_caps)
+            if cap_version != self._cap_version:
+                self._cap_version = cap_version
+                self._weights = self._cap_weights(market_caps, math.sqrt if self.strategy == 'sqrt_cap' else lambda v: v)
+        if self.strategy == 'inverse_vol' and self.volatility is not None:
+            vols = {c: self.volatility.volatility(c) for c in self._selection}
+            if all(v > 0 for v in vols.values()):
+                return self._normalize({c: 1 / v for c, v in vols.items()})
+            logger.debug("Not enough volatility history yet, using equal weights")
+        return dict(self._weights)
@@ -1,10 +1,13 @@
 import websocket
+import re
 import hmac
 import hashlib
 import time
+import random
 import base64
 import json
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -22,15 +25,29 @@ def get_auth_headers(timestamp, message, api_key, secret_key, passphrase):
         'CB-ACCESS-PASSPHRASE': passphrase
     }
 
+def reconnect_delay(attempt, base, cap):
+    # Exponential backoff with full jitter, so clients dropped by the same
+    # outage do not all reconnect in the same second
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+HEARTBEAT = re.compile(r'"type"\s*:\s*"heartbeat"')
+
+def is_heartbeat(msg):
+    # Heartbeats are only used for liveness, skip them without decoding. The
+    # pattern matches the type field wherever it is and however it is spaced.
+    return msg is not None and HEARTBEAT.search(msg) is not None
+
 class CBChannelServer(object):
 
     host = "wss://ws-feed.pro.coinbase.com"
     wsc = None
 
     def __init__(self, pairs, channel, host="wss://ws-feed.pro.coinbase.com", 
-                auth=False, api_key="", api_secret="", api_passphrase="", reconnect_interval=30,  ping=30, ping_timeout=15):
+                auth=False, api_key="", api_secret="", api_passphrase="", reconnect_interval=1, max_reconnect_interval=60, ping=30, ping_timeout=15, heartbeat=True):
         self.pairs = pairs
         self.channels = [channel]
+        if heartbeat:
+            self.channels.append('heartbeat')
         self.host = host
         self.auth = auth
         self.api_key = api_key
@@ -40,6 +57,11 @@ class CBChannelServer(object):
         self._ping_interval=ping
         self._ping_timeout = ping_timeout
         self._reconnect_interval = reconnect_interval
+        self._max_reconnect_interval = max_reconnect_interval
+        self._attempts = 0
+        self._closed = threading.Event()
+        self.last_message = None
+        self.reconnects = 0
 
     def _build_subscribe_msg(self):
         subscribe_msg = {
@@ -61,6 +83,7 @@ class CBChannelServer(object):
         subscribe_msg = self._build_subscribe_msg()
         logger.debug("Connecting and sending subscribe message: %s" % subscribe_msg)
         self._need_reconnection = True
+        self.last_message = time.monotonic()
         try:
             ws.send(json.dumps(subscribe_msg))
         except Exception as e:
@@ -72,6 +95,10 @@ class CBChannelServer(object):
 
     def _on_message(self, ws, msg):
         # logger.debug("Received message: %s" % msg)
+        self.last_message = time.monotonic()
+        self._attempts = 0
+        if is_heartbeat(msg):
+            return
         try:
             self.on_message(msg)
         except Exception as e:
@@ -84,8 +111,9 @@ class CBChannelServer(object):
         except Exception as e:
             logger.error("Unable to run on error function: %s" % e)
 
-    def _on_close(self, ws):
+    def _on_close(self, ws, *args):
         logger.debug("Connection closed")
+        self.last_message = None
         try:
             self.on_close()
         except Exception as e:
@@ -109,15 +137,41 @@ class CBChannelServer(object):
             on_pong=self._on_pong)
 
         logger.debug("Connecting to server with ping interval %s and ping timeout %s" % (self._ping_interval, self._ping_timeout))
-        self.wsc.run_forever(ping_interval=self._ping_interval, ping_timeout=self._ping_timeout)
-        while self._need_reconnection:
-            logger.debug("Attempting to reconnect...")
+        self._need_reconnection = True
+        while not self._closed.is_set():
             self.wsc.run_forever(ping_interval=self._ping_interval, ping_timeout=self._ping_timeout)
-            time.sleep(self._reconnect_interval)
+            if not self._need_reconnection:
+                break
+            delay = reconnect_delay(self._attempts, self._reconnect_interval, self._max_reconnect_interval)
+            self._attempts += 1
+            self.reconnects += 1
+            logger.debug("Attempting to reconnect to %s in %.1fs..." % (self.channels, delay))
+            if self._closed.wait(delay):
+                break
+
+    def is_stale(self, timeout):
+        # No message, heartbeat included, for timeout seconds on an open
+        # connection. Heartbeats arrive every second per product.
+        return self.last_message is not None and time.monotonic() - self.last_message > timeout
+
+    def reconnect(self):
+        # Drops the current connection and lets the connect() loop open a new
+        # one, keeping the client and its resources
+        logger.warning("Forcing reconnection of %s" % self.channels)
+        self.last_message = None
+        if self.wsc is not None:
+            self.wsc.close()
+
+    def check_health(self, timeout):
+        if self.is_stale(timeout):
+            self.reconnect()
+            return False
+        return True
 
     def close(self):
         logger.debug("Closing connection...")
         self._need_reconnection = False
+        self._closed.set()
         if self.wsc is not None:
             self.wsc.close()
 
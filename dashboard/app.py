@@ -1,20 +1,28 @@
 import sqlalchemy
 from bot import ws
+from bot.supervisor import ConnectionSupervisor
 import model.db as model
-import dash
-import dash_core_components as dcc
-import dash_html_components as html
-from dash.dependencies import Input, Output, State
-import dash_table
-import plotly.express as px
-import pandas as pd
-import numpy as np
+import model.queries as queries
+import math
 import json
-import time
 import uuid
 import threading
+import datetime
+import os
+import time
 
 BASE_CURRENCY = 'BTC'
+ASYNC_DB = os.environ.get('CRYPTOBOT_ASYNC_DB', '').lower() in ('1', 'true')
+# 'db' reads the prices published by start_price_stream.py, so any number of
+# workers share one feed; 'feed' opens a ticker connection per process
+PRICE_SOURCE = os.environ.get('CRYPTOBOT_PRICE_SOURCE', 'db')
+PRICES_TTL = 1.0
+EXECUTIONS_TTL = 60.0
+# Live updates are pushed over /events; the interval only refreshes the
+# execution list and is a fallback when no events arrive
+REFRESH_INTERVAL = 60000
+PUSH_INTERVAL = 250
+TRANSACTIONS_PAGE_SIZE = 10
 
 class TickerClient(ws.CBChannelServer, threading.Thread):
 
@@ -23,13 +31,13 @@ class TickerClient(ws.CBChannelServer, threading.Thread):
         threading.Thread.__init__(self)
         self.daemon = True
         self.last_prices = {}
+        self.hub = None
 
     def run(self):
         self.connect()
 
     def on_open(self):
         print("Connecting to TICKER channel")
-        self.session = model.connect_to_session()
         self.error = None
 
     def on_message(self, msg):
@@ -39,34 +47,96 @@ class TickerClient(ws.CBChannelServer, threading.Thread):
             if 'type' in msg and 'price' in msg and 'product_id' in msg:
                 if msg.get('product_id') is not None:
                     self.last_prices[msg.get('product_id')] = float(msg.get('price'))
+                    if self.hub is not None:
+                        self.hub.publish({'type': 'prices', 'prices': {msg.get('product_id'): self.last_prices[msg.get('product_id')]}})
 
     def on_close(self):
         print("Lost connection to TICKER")
-        self.session.close()
 
     def on_error(self, e):
         self.error = e
-        self.stop = True
         print("There was an error with TICKER subscription: %s" % e)
-session = model.connect_to_session()
-try:
-    currency_pairs = session.execute(sqlalchemy.select(model.Pairs.symbol)).scalars().all()
-
-    ticker_wsClient = TickerClient(currency_pairs)
-    execution_ids = session.execute(sqlalchemy.select(model.Execution)).scalars().all()
-    executions_dict = {e.id: e for e in execution_ids}
-    execution_options = [{'label': e.name, 'value': str(e.id)} for e in execution_ids]
-    ticker_wsClient.start()
-    # t0 = time.time()
-    # while len(ticker_wsClient.last_prices) != len(currency_pairs) and time.time() - t0 < 5 * 60:
-    #     time.sleep(1)
-except Exception as e:
-    raise
-
-app = dash.Dash(__name__)
-server = app.server
+
+class DBPriceSource(object):
+
+    def __init__(self, ttl=PRICES_TTL):
+        self.ttl = ttl
+        self._prices = {}
+        self._loaded = 0
+        self._lock = threading.Lock()
+
+    @property
+    def last_prices(self):
+        with self._lock:
+            if time.time() - self._loaded > self.ttl:
+                session = model.connect_to_session(model.REPLICA)
+                try:
+                    self._prices = {symbol: price for symbol, price in session.execute(queries.last_prices_query()).all()}
+                finally:
+                    session.close()
+                self._loaded = time.time()
+            return self._prices
+
+# Created by create_app(); importing this module has no side effects
+app = None
+server = None
+
+# Per-process resources, created on first use so that a pre-forking server
+# never hands a socket or thread from the master to its workers
+_resources = {'pid': None, 'price_source': None, 'hub': None, 'executions': [], 'executions_loaded': 0}
+_resources_lock = threading.Lock()
+
+def _worker_resources():
+    if _resources['pid'] != os.getpid():
+        _resources.update({'pid': os.getpid(), 'price_source': None, 'hub': None, 'executions': [], 'executions_loaded': 0})
+    return _resources
+
+def _get_hub(resources):
+    if resources['hub'] is None:
+        import model.notify as notify
+        from dashboard.push import Hub, NotifyListener
+        resources['hub'] = Hub()
+        NotifyListener(resources['hub'], model.get_db_string(model.PRIMARY), notify.CHANNEL).start()
+    return resources['hub']
+
+def get_hub():
+    with _resources_lock:
+        return _get_hub(_worker_resources())
+
+def get_price_source():
+    with _resources_lock:
+        resources = _worker_resources()
+        if resources['price_source'] is None:
+            if PRICE_SOURCE == 'feed':
+                session = model.connect_to_session(model.REPLICA)
+                try:
+                    currency_pairs = session.execute(sqlalchemy.select(model.Pairs.symbol)).scalars().all()
+                finally:
+                    session.close()
+                price_source = TickerClient(currency_pairs)
+                price_source.hub = _get_hub(resources)
+                price_source.start()
+                ConnectionSupervisor([price_source]).start()
+            else:
+                price_source = DBPriceSource()
+            resources['price_source'] = price_source
+        return resources['price_source']
+
+def get_execution_options():
+    with _resources_lock:
+        resources = _worker_resources()
+        if time.time() - resources['executions_loaded'] > EXECUTIONS_TTL:
+            session = model.connect_to_session(model.REPLICA)
+            try:
+                resources['executions'] = [{'label': name, 'value': str(i)} for i, name in session.execute(queries.executions_query()).all()]
+            finally:
+                session.close()
+            resources['executions_loaded'] = time.time()
+        return resources['executions']
 
 def current_positions(positions):
+    import pandas as pd
+    import plotly.express as px
     df = pd.DataFrame.from_dict(positions, orient='index', columns=['Value']).reset_index().rename(columns={'index': 'Asset'})
     fig = px.pie(df, values='Value', names='Asset', hole=0.3, title='Allocation')
     fig.update_layout(
@@ -84,6 +154,8 @@ def current_positions(positions):
     return fig
 
 def portfolio_value(values, current_fig):
+    import pandas as pd
+    import plotly.express as px
     portfolio_data = {dt: sum(v.values()) for dt, v in values.items()}
     df = pd.DataFrame.from_dict(portfolio_data, orient='index', columns=['Value']).reset_index().rename(columns={'index': 'Time'})
     if current_fig is None:
@@ -114,125 +186,330 @@ def portfolio_value(values, current_fig):
     return fig
 
 def _get_current_values(positions, prices):
-    current_prices = {n.split('-', 1)[0]: v for n, v in ticker_wsClient.last_prices.items() if n.split('-', 1)[1] == BASE_CURRENCY}
-    current_positions = {n: v * current_prices.get(n) for n, v in positions.items() if n in current_prices}
-    if len(current_positions) != len(positions):
+    from bot.valuation import get_valuation
+    valuation = get_valuation(tuple(sorted(set(positions) | {BASE_CURRENCY})), BASE_CURRENCY, tuple(sorted(prices)))
+    current_positions = valuation.value(positions, prices)
+    if any(math.isnan(v) for v in current_positions.values()):
         current_positions = {}
     current_positions.update({BASE_CURRENCY: positions.get(BASE_CURRENCY, 0)})
     return current_positions
 
-@app.callback([
-                Output('positions-graph', 'figure'),
-                Output('portfolio-value-graph', 'figure'),
-                Output('transaction-table', 'data'),
-                Output('current-value-text', 'children'),
-                Output('price-table', 'data')
-                ],
-                Input('interval-component', 'n_intervals'),
-                Input('execution-id-choice', 'value'),
-                State('portfolio-value-graph', 'figure')
-            )
-def update_positions(n, execution_id, current_portfolio_fig):
-    session = model.connect_to_session()
-    # execution_id = session.execute(sqlalchemy.select(model.Execution)).scalar().id
+def _load_execution_data(execution_id):
+    if ASYNC_DB:
+        import model.aio as aio
+        return aio.call(aio.gather(
+            aio.get_latest_positions(execution_id),
+            aio.get_execution_metrics(execution_id)))
+    session = model.connect_to_session(model.REPLICA)
+    try:
+        result_dic = queries.get_latest_positions(session, execution_id)
+        metrics = queries.get_execution_metrics(session, execution_id)
+    finally:
+        session.close()
+    return result_dic, metrics
+
+def _load_order_history(execution_id, page_size, **kwargs):
+    if ASYNC_DB:
+        import model.aio as aio
+        return aio.call(aio.get_order_history(execution_id, page_size, **kwargs))
+    session = model.connect_to_session(model.REPLICA)
+    try:
+        return queries.get_order_history(session, execution_id, page_size, **kwargs)
+    finally:
+        session.close()
+
+FILTER_OPERATORS = ['>=', '<=', '<', '>', '=', 'contains', 'datestartswith']
+
+def _split_filter_part(part):
+    # '{Pair} contains ETH' -> ('Pair', 'contains', 'ETH'), following the
+    # syntax of the DataTable filter row
+    for operator in FILTER_OPERATORS:
+        for token in (' %s ' % operator, ' %s ' % {'>=': 'ge', '<=': 'le', '<': 'lt', '>': 'gt', '=': 'eq'}.get(operator, operator)):
+            if token in part:
+                name, value = part.split(token, 1)
+                value = value.strip()
+                if value and value[0] == value[-1] and value[0] in ('"', "'", '`'):
+                    value = value[1:-1]
+                return name.strip()[1:-1], operator, value
+    return None, None, None
+
+def _date_range(value):
+    # Prefix of an ISO date: 2021, 2021-10 or 2021-10-20
+    parts = [int(p) for p in value.split('T')[0].split('-') if p]
+    if len(parts) == 1:
+        return datetime.datetime(parts[0], 1, 1), datetime.datetime(parts[0] + 1, 1, 1)
+    if len(parts) == 2:
+        start = datetime.datetime(parts[0], parts[1], 1)
+        return start, datetime.datetime(parts[0] + parts[1] // 12, parts[1] % 12 + 1, 1)
+    start = datetime.datetime(parts[0], parts[1], parts[2])
+    return start, start + datetime.timedelta(days=1)
+
+def _has_time(value):
+    return 'T' in value or ' ' in value
+
+def _upper_bound(value, inclusive):
+    # Exclusive end for '<' / '<=': a bare date covers its whole day when
+    # inclusive, a time is made inclusive by moving one microsecond past it
+    if not _has_time(value):
+        return _date_range(value)[1] if inclusive else _date_range(value)[0]
+    end = datetime.datetime.fromisoformat(value)
+    return end + datetime.timedelta(microseconds=1) if inclusive else end
+
+def _lower_bound(value, inclusive):
+    # Inclusive start for '>=' / '>', mirroring _upper_bound
+    if not _has_time(value):
+        return _date_range(value)[0] if inclusive else _date_range(value)[1]
+    start = datetime.datetime.fromisoformat(value)
+    return start if inclusive else start + datetime.timedelta(microseconds=1)
+
+def parse_transaction_filter(filter_query):
+    # Filters that map onto order_history_query; anything else is ignored
+    kwargs = {}
+    for part in (filter_query or '').split(' && '):
+        name, operator, value = _split_filter_part(part)
+        if not value:
+            continue
+        try:
+            if name == 'Pair':
+                kwargs['pair'] = value.upper()
+            elif name == 'Side':
+                kwargs['side'] = value.lower()
+            elif name == 'Status':
+                kwargs['status'] = value.lower()
+            elif name == 'Timestamp':
+                if operator == 'datestartswith' or operator == '=' or operator == 'contains':
+                    kwargs['start'], kwargs['end'] = _date_range(value)
+                elif operator in ('>=', '>'):
+                    kwargs['start'] = _lower_bound(value, operator == '>=')
+                else:
+                    kwargs['end'] = _upper_bound(value, operator == '<=')
+        except ValueError:
+            continue
+    return kwargs
+
+def metrics_text(metrics):
+    import dash_html_components as html
+    if not metrics:
+        return []
+    return [
+        html.P("PnL: %.8f %s" % (metrics['pnl'], BASE_CURRENCY)),
+        html.P("Drawdown: %.2f%% (max %.2f%%)" % (100 * metrics['drawdown'], 100 * metrics['max_drawdown'])),
+        html.P("Turnover: %.8f %s in %s fills" % (metrics['turnover'], BASE_CURRENCY, metrics['fills'])),
+        html.P("Fees: %.8f %s" % (metrics['fees'], BASE_CURRENCY))
+    ]
+
+def update_executions(n, execution_id):
+    options = get_execution_options()
+    if execution_id is None and options:
+        execution_id = options[-1]['value']
+    return options, execution_id
+
+def update_transactions(page_current, page_size, sort_by, filter_query, execution_id, refresh, state):
+    # Keyset pagination: state keeps the (timestamp, id) cursor at which each
+    # visited page starts, reset whenever the execution, filter or sort
+    # changes. A jump past the known pages is one query that seeks to the
+    # nearest known cursor and skips the pages in between.
+    import dash
+    from dash.exceptions import PreventUpdate
+    if execution_id is None:
+        raise PreventUpdate
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    pushed = 'push-refresh.data' in triggered
+    if pushed and page_current:
+        # New fills only change the first page, leave browsing undisturbed
+        raise PreventUpdate
+    key = [execution_id, filter_query or '', sort_by or []]
+    if state is None or state.get('key') != key or pushed:
+        state = {'key': key, 'cursors': {'0': None}}
+    kwargs = parse_transaction_filter(filter_query)
+    kwargs['ascending'] = any(s.get('column_id') == 'Timestamp' and s.get('direction') == 'asc' for s in sort_by or [])
+    # Cursors by page number (JSON keys are strings), with gaps after jumps
+    cursors = state['cursors']
+    target = page_current or 0
+    page = max(int(p) for p in cursors if int(p) <= target)
+    after = cursors[str(page)]
+    if after is not None:
+        after = (datetime.datetime.fromisoformat(after[0]), uuid.UUID(after[1]))
+    records, next_cursor = _load_order_history(uuid.UUID(execution_id), page_size, after=after, offset=(target - page) * page_size, **kwargs)
+    if next_cursor is not None:
+        cursors[str(target + 1)] = [next_cursor[0].isoformat(), str(next_cursor[1])]
+    return records, state
+
+def update_positions(n, execution_id, refresh, current_portfolio_fig):
+    if execution_id is None:
+        from dash.exceptions import PreventUpdate
+        raise PreventUpdate
     execution_id = uuid.UUID(execution_id)
-    subq = sqlalchemy.select(sqlalchemy.func.max(model.Positions.timestamp)).subquery()
-    positions_query = sqlalchemy.select(model.Positions).join(subq, model.Positions.timestamp == subq).filter(model.Positions.execution_id == execution_id)
-    result = session.execute(positions_query).scalars().all()
-    # result = session.execute(sqlalchemy.select(model.Positions.value, model.Positions.timestamp, model.Positions.symbol).filter(model.Positions.execution_id == execution_id)).all()
-    transactions_query = sqlalchemy.select(model.Transaction).filter(sqlalchemy.and_(model.Transaction.execution_id == execution_id, model.Transaction.status == 'pending'))
-    last_transactions_pending = session.execute(transactions_query.order_by(model.Transaction.timestamp.desc()).limit(10)).scalars().all()
-    pending_ids = {x.order_id: x for x in last_transactions_pending}
-    last_transactions = session.execute(sqlalchemy.select(model.Transaction).filter(model.Transaction.order_id.in_(pending_ids.keys())).order_by(model.Transaction.timestamp.desc())).scalars().all()
-    filled_ids= {x.order_id: x for x in last_transactions if x.status == 'filled'}
-    matched_ids = {x.order_id: x for x in last_transactions if x.status == 'matched'}
-    orders_records = [
-        {'Timestamp': matched_ids.get(k, v).timestamp, 
-        'Pair': filled_ids.get(k, v).pair.symbol, 
-        'Size': matched_ids.get(k, v).size, 
-        'Funds': v.funds, 
-        'Price': matched_ids.get(k, v).price, 
-        'Side': filled_ids.get(k, v).side, 
-        'Status': filled_ids.get(k, v).status} for k, v in pending_ids.items()]
+    last_prices = get_price_source().last_prices
+    result_dic, metrics = _load_execution_data(execution_id)
     prices_records = [
         {
         'Pair': n,
         'Price': v
-        } for n, v in ticker_wsClient.last_prices.items()]
-    session.close()
-    result_dic = {r.symbol: r.value for r in result}
-    # current_prices = {n.split('-', 1)[0]: v for n, v in ticker_wsClient.last_prices.items()}
+        } for n, v in last_prices.items()]
+    # current_prices = {n.split('-', 1)[0]: v for n, v in last_prices.items()}
     # result_dic = {n: v * current_prices.get(n) if current_prices.get(n) is not None else v for n, v in result_dic.items()}
-    result_dic = _get_current_values(result_dic, ticker_wsClient.last_prices)
+    result_dic = _get_current_values(result_dic, last_prices)
     fig_positions = current_positions(result_dic)
-    fig_portfolio_value = portfolio_value({pd.Timestamp(1).now(): result_dic}, current_portfolio_fig)
+    fig_portfolio_value = portfolio_value({datetime.datetime.now(): result_dic}, current_portfolio_fig)
     current_value_text = "%s %s" % (sum(result_dic.values()), BASE_CURRENCY)
-    return fig_positions, fig_portfolio_value, orders_records, current_value_text, prices_records
-
-#Layout
-app.layout = html.Div([
-    html.Div(className='row', children=[
-        html.Div(className='four columns div-user-controls', children=[
-            html.H1('Cryptobot dashboard'),
-            html.H4(id='current-value-text'),
-            html.P('Current execution'),
-            html.Div(
-                className='div-for-dropdown',
-                children= [
-                        dcc.Dropdown(
-                                        id='execution-id-choice',
-                                        options=execution_options,
-                                        value=execution_options[-1]['value'],
-                                        clearable=False
-                                    )
-                ],
-                style={'color': '#1E1E1E'}
-            ),
-            dcc.Graph(id='positions-graph'),
-            html.H4('Current prices'),
-            dash_table.DataTable(
-                    id='price-table',
-                    columns=[{'id': c, 'name': c} for c in ['Pair', 'Price']],
-                    page_size=15,
-                    style_as_list_view=True,
-                    style_header={'backgroundColor': 'rgb(30, 30, 30)'},
-                    style_cell={
-                                'backgroundColor': 'rgb(50, 50, 50)',
-                                'color': 'white'
-                                },
-                    sort_action='native',
-            ),
-        ]),
-        html.Div(className='eight columns div-for-charts bg-grey', children=[
-            dcc.Graph(id='portfolio-value-graph'),
-            html.Div(
-                style={'width': '85%'},
-                children=[
-                        html.H4('Recent transactions'),
-                        dash_table.DataTable(
-                            id='transaction-table',
-                            columns=[{'id': c, 'name': c} for c in ['Timestamp', 'Pair', 'Size', 'Funds', 'Price', 'Side', 'Status']],
-                            page_size=10,
-                            style_as_list_view=True,
-                            style_header={'backgroundColor': 'rgb(30, 30, 30)'},
-                            style_cell={
-                                        'backgroundColor': 'rgb(50, 50, 50)',
-                                        'color': 'white'
-                                        },
-            ),
-                ]
-            ),
-            dcc.Interval(
-                            id='interval-component',
-                            n_intervals=0,
-                            interval=5000
-                        ),
+    return fig_positions, fig_portfolio_value, current_value_text, prices_records, metrics_text(metrics)
+
+def layout():
+    import dash_core_components as dcc
+    import dash_html_components as html
+    import dash_table
+    return html.Div([
+        html.Div(className='row', children=[
+            html.Div(className='four columns div-user-controls', children=[
+                html.H1('Cryptobot dashboard'),
+                html.H4(id='current-value-text'),
+                html.Div(id='metrics-text'),
+                html.P('Current execution'),
+                html.Div(
+                    className='div-for-dropdown',
+                    children= [
+                            dcc.Dropdown(
+                                            id='execution-id-choice',
+                                            options=[],
+                                            value=None,
+                                            clearable=False
+                                        )
+                    ],
+                    style={'color': '#1E1E1E'}
+                ),
+                dcc.Graph(id='positions-graph'),
+                html.H4('Current prices'),
+                dash_table.DataTable(
+                        id='price-table',
+                        columns=[{'id': c, 'name': c} for c in ['Pair', 'Price']],
+                        page_size=15,
+                        style_as_list_view=True,
+                        style_header={'backgroundColor': 'rgb(30, 30, 30)'},
+                        style_cell={
+                                    'backgroundColor': 'rgb(50, 50, 50)',
+                                    'color': 'white'
+                                    },
+                        sort_action='native',
+                ),
+            ]),
+            html.Div(className='eight columns div-for-charts bg-grey', children=[
+                dcc.Graph(id='portfolio-value-graph'),
+                html.Div(
+                    style={'width': '85%'},
+                    children=[
+                            html.H4('Transactions'),
+                            dash_table.DataTable(
+                                id='transaction-table',
+                                columns=[{'id': c, 'name': c} for c in queries.ORDER_COLUMNS],
+                                page_current=0,
+                                page_size=TRANSACTIONS_PAGE_SIZE,
+                                page_action='custom',
+                                sort_action='custom',
+                                sort_mode='single',
+                                sort_by=[],
+                                filter_action='custom',
+                                filter_query='',
+                                style_as_list_view=True,
+                                style_header={'backgroundColor': 'rgb(30, 30, 30)'},
+                                style_cell={
+                                            'backgroundColor': 'rgb(50, 50, 50)',
+                                            'color': 'white'
+                                            },
+                ),
+                    ]
+                ),
+                dcc.Interval(
+                                id='interval-component',
+                                n_intervals=0,
+                                interval=REFRESH_INTERVAL
+                            ),
+                dcc.Interval(
+                                id='push-interval',
+                                n_intervals=0,
+                                interval=PUSH_INTERVAL
+                            ),
+                dcc.Store(id='push-store'),
+                dcc.Store(id='push-refresh'),
+                dcc.Store(id='prices-snapshot'),
+                dcc.Store(id='transaction-cursors'),
+                ])
             ])
         ])
-    ])
+
+def register_callbacks(app):
+    from dash.dependencies import Input, Output, State, ClientsideFunction
+    app.callback([
+                Output('positions-graph', 'figure'),
+                Output('portfolio-value-graph', 'figure'),
+                Output('current-value-text', 'children'),
+                Output('prices-snapshot', 'data'),
+                Output('metrics-text', 'children')
+                ],
+                Input('interval-component', 'n_intervals'),
+                Input('execution-id-choice', 'value'),
+                Input('push-refresh', 'data'),
+                State('portfolio-value-graph', 'figure')
+            )(update_positions)
+    app.callback([
+                Output('transaction-table', 'data'),
+                Output('transaction-cursors', 'data')
+                ],
+                Input('transaction-table', 'page_current'),
+                Input('transaction-table', 'page_size'),
+                Input('transaction-table', 'sort_by'),
+                Input('transaction-table', 'filter_query'),
+                Input('execution-id-choice', 'value'),
+                Input('push-refresh', 'data'),
+                State('transaction-cursors', 'data')
+            )(update_transactions)
+    # Pushed deltas are drained from the browser's buffer without a server
+    # round trip; prices are merged client side and only a new fill or
+    # portfolio value of the shown execution refreshes the figures
+    app.clientside_callback(
+                ClientsideFunction('push', 'drain'),
+                Output('push-store', 'data'),
+                Input('push-interval', 'n_intervals')
+            )
+    app.clientside_callback(
+                ClientsideFunction('push', 'prices'),
+                Output('price-table', 'data'),
+                Input('push-store', 'data'),
+                Input('prices-snapshot', 'data'),
+                State('price-table', 'data')
+            )
+    app.clientside_callback(
+                ClientsideFunction('push', 'refresh'),
+                Output('push-refresh', 'data'),
+                Input('push-store', 'data'),
+                State('execution-id-choice', 'value')
+            )
+    app.callback([
+                Output('execution-id-choice', 'options'),
+                Output('execution-id-choice', 'value')
+                ],
+                Input('interval-component', 'n_intervals'),
+                State('execution-id-choice', 'value')
+            )(update_executions)
+
+def create_app():
+    # Safe to call before forking: no connections or threads are created
+    # until a worker serves its first callback
+    global app, server
+    import dash
+    app = dash.Dash(__name__)
+    server = app.server
+    app.layout = layout()
+    register_callbacks(app)
+    from dashboard.push import register
+    register(server, get_hub, app.config.routes_pathname_prefix + 'events')
+    return app
 
 def start():
-    app.run_server(debug=True)
+    global PRICE_SOURCE
+    # The development server is a single process and can own the feed
+    PRICE_SOURCE = os.environ.get('CRYPTOBOT_PRICE_SOURCE', 'feed')
+    create_app().run_server(debug=True)
 
 if __name__ == "__main__":
     start()
\ No newline at end of file
@@ -0,0 +1,61 @@
+// Live updates from the /events stream. Deltas are merged into one pending
+// object until the push-interval clientside callback drains it, so a burst of
+// events costs the page a single update.
+(function() {
+    var pending = null;
+    var snapshot = null;
+
+    function merge(delta) {
+        if (pending === null) {
+            pending = {prices: {}, fills: [], values: {}};
+        }
+        Object.assign(pending.prices, delta.prices || {});
+        Object.assign(pending.values, delta.values || {});
+        pending.fills = pending.fills.concat(delta.fills || []).slice(-100);
+    }
+
+    if (window.EventSource) {
+        var source = new EventSource('events');
+        source.onmessage = function(e) {
+            merge(JSON.parse(e.data));
+        };
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        push: {
+            drain: function(n) {
+                if (pending === null) {
+                    return window.dash_clientside.no_update;
+                }
+                var delta = pending;
+                pending = null;
+                return delta;
+            },
+            prices: function(delta, prices, data) {
+                var rows = {};
+                var base = data;
+                if (prices !== snapshot) {
+                    // A server refresh replaces the table
+                    snapshot = prices;
+                    base = prices;
+                    delta = null;
+                } else if (!delta || Object.keys(delta.prices).length === 0) {
+                    return window.dash_clientside.no_update;
+                }
+                (base || []).forEach(function(r) { rows[r.Pair] = r.Price; });
+                Object.assign(rows, delta ? delta.prices : {});
+                return Object.keys(rows).map(function(p) { return {Pair: p, Price: rows[p]}; });
+            },
+            refresh: function(delta, executionId) {
+                if (!delta || !executionId) {
+                    return window.dash_clientside.no_update;
+                }
+                var fills = delta.fills.some(function(f) { return f.execution_id === executionId; });
+                if (fills || executionId in delta.values) {
+                    return Date.now();
+                }
+                return window.dash_clientside.no_update;
+            }
+        }
+    });
+})();
@@ -0,0 +1,163 @@
+import json
+import time
+import queue
+import select
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Server-sent events for the dashboard. Producers (the Postgres NOTIFY
+# listener, or the in-process ticker feed) publish small deltas to a Hub,
+# which merges them and emits at most one frame per FRAME_INTERVAL to every
+# open /events stream. Nothing runs while nothing changes: the frame thread
+# blocks until an event arrives and idle streams only send a keepalive.
+
+FRAME_INTERVAL = 0.25
+KEEPALIVE = 15
+MAX_FILLS = 100
+SUBSCRIBER_QUEUE = 32
+
+class Hub(object):
+
+    def __init__(self, frame_interval=FRAME_INTERVAL):
+        self.frame_interval = frame_interval
+        self.subscribers = set()
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._reset()
+        self._thread = threading.Thread(target=self._run, name='push-frames', daemon=True)
+        self._thread.start()
+
+    def _reset(self):
+        self._prices = {}
+        self._fills = []
+        self._values = {}
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        with self._lock:
+            self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self.subscribers.discard(q)
+
+    def publish(self, event):
+        kind = event.get('type')
+        with self._lock:
+            if kind == 'prices':
+                self._prices.update(event.get('prices', {}))
+            elif kind == 'fill':
+                self._fills.append({k: v for k, v in event.items() if k != 'type'})
+                del self._fills[:-MAX_FILLS]
+            elif kind == 'value':
+                self._values[event.get('execution_id')] = {'timestamp': event.get('timestamp'), 'value': event.get('value')}
+            else:
+                return
+        self._changed.set()
+
+    def _frame(self):
+        with self._lock:
+            self._changed.clear()
+            delta = {}
+            if self._prices:
+                delta['prices'] = self._prices
+            if self._fills:
+                delta['fills'] = self._fills
+            if self._values:
+                delta['values'] = self._values
+            self._reset()
+            subscribers = list(self.subscribers)
+        if not delta or not subscribers:
+            return
+        frame = 'data: %s\n\n' % json.dumps(delta, separators=(',', ':'))
+        for q in subscribers:
+            try:
+                q.put_nowait(frame)
+            except queue.Full:
+                # A slow client loses its oldest frame rather than holding
+                # memory; prices are absolute and figures refresh on the
+                # next value so it catches up
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+                q.put_nowait(frame)
+
+    def _run(self):
+        while True:
+            self._changed.wait()
+            # Let the burst that woke us coalesce into one frame
+            time.sleep(self.frame_interval)
+            self._frame()
+
+    def stream(self):
+        q = self.subscribe()
+        try:
+            yield 'retry: 2000\n\n'
+            while True:
+                try:
+                    yield q.get(timeout=KEEPALIVE)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+        finally:
+            self.unsubscribe(q)
+
+class NotifyListener(threading.Thread):
+    # LISTENs on the primary (notifications are not replicated) with a plain
+    # psycopg2 connection outside the pool, and forwards payloads to the hub
+
+    def __init__(self, hub, dsn, channel):
+        threading.Thread.__init__(self, name='push-listener')
+        self.daemon = True
+        self.hub = hub
+        self.dsn = dsn
+        self.channel = channel
+
+    def _listen(self):
+        import psycopg2
+        import psycopg2.extensions
+        connection = psycopg2.connect(self.dsn)
+        try:
+            connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = connection.cursor()
+            cursor.execute('LISTEN %s' % self.channel)
+            logger.info("Listening for dashboard events on %s" % self.channel)
+            self.attempts = 0
+            while True:
+                if select.select([connection], [], [], KEEPALIVE) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notification = connection.notifies.pop(0)
+                    try:
+                        self.hub.publish(json.loads(notification.payload))
+                    except ValueError:
+                        logger.error("Invalid event payload: %s" % notification.payload)
+        finally:
+            connection.close()
+
+    def run(self):
+        from bot.ws import reconnect_delay
+        self.attempts = 0
+        while True:
+            try:
+                self._listen()
+            except Exception as e:
+                logger.error("Lost dashboard event listener: %s" % e, exc_info=True)
+            time.sleep(reconnect_delay(self.attempts, 1, 60))
+            self.attempts += 1
+
+def register(server, get_hub, path='/events'):
+    from flask import Response, stream_with_context
+
+    def events():
+        return Response(
+            stream_with_context(get_hub().stream()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    server.add_url_rule(path, 'events', events)
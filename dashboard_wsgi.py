@@ -2,8 +2,6 @@ import dashboard.app as dashboard
 import logging
 import logging.handlers
 
-server = dashboard.server
-
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 # create console handler and set level to debug
@@ -21,5 +19,7 @@ ch2.setFormatter(formatter)
 logger.addHandler(ch1)
 logger.addHandler(ch2)
 
+server = dashboard.create_app().server
+
 if __name__ == "__main__":
     server.run()
\ No newline at end of file
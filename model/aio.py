@@ -0,0 +1,178 @@
+import os
+import asyncio
+import datetime
+import threading
+import logging
+import sqlalchemy
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+import model.db as model
+import model.queries as queries
+import model.metrics as metrics
+import model.notify as notify
+
+# Optional asyncio access layer (SQLAlchemy asyncio + asyncpg). All coroutines
+# run on one background event loop so the asyncpg pool is never shared across
+# loops; sync callers use call() to wait for a result or submit() to fire and
+# forget. Writes go through submit_write(), which bounds the writes in flight
+# so a slow database holds the caller back instead of piling coroutines up on
+# the loop.
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+_loop = None
+_loop_lock = threading.Lock()
+_sessionmakers = {}
+
+MAX_PENDING_WRITES = 32
+WRITE_TIMEOUT = 5.0
+_pending_writes = threading.BoundedSemaphore(MAX_PENDING_WRITES)
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            t = threading.Thread(target=_loop.run_forever, name='db-async-loop', daemon=True)
+            t.start()
+    return _loop
+
+def _create_engine(role):
+    parameters = model.get_db_configuration()
+    db_string = parameters[role].replace('postgresql://', 'postgresql+asyncpg://', 1)
+    if role == model.REPLICA:
+        server_settings = {
+            'statement_timeout': str(parameters['replica_statement_timeout']),
+            'default_transaction_read_only': 'on',
+            'application_name': 'cryptobot_replica'
+        }
+        return create_async_engine(db_string, pool_size=parameters['replica_pool_size'], max_overflow=parameters['replica_pool_size'],
+            pool_timeout=5, pool_recycle=3600, connect_args={'server_settings': server_settings}, echo=False)
+    return create_async_engine(db_string, pool_recycle=3600, echo=False)
+
+def _get_sessionmaker(role):
+    if role not in _sessionmakers:
+        _sessionmakers[role] = sessionmaker(bind=_create_engine(role), class_=AsyncSession, expire_on_commit=False)
+    return _sessionmakers[role]
+
+def _after_fork():
+    # The event loop thread does not survive a fork; start over in the child
+    global _loop, _loop_lock, _pending_writes
+    for Session in _sessionmakers.values():
+        Session.kw['bind'].sync_engine.dispose(close=False)
+    _sessionmakers.clear()
+    _loop = None
+    _loop_lock = threading.Lock()
+    _pending_writes = threading.BoundedSemaphore(MAX_PENDING_WRITES)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+def _to_datetime(value):
+    # asyncpg does not coerce the ISO strings psycopg2 accepts
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+def _to_float(value):
+    return float(value) if value is not None else None
+
+def connect_to_session(role=model.PRIMARY):
+    return _get_sessionmaker(role)()
+
+def submit(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop())
+
+def call(coro, timeout=None):
+    return submit(coro).result(timeout)
+
+def _write_done(description, semaphore):
+    def done(future):
+        semaphore.release()
+        if not future.cancelled() and future.exception() is not None:
+            e = future.exception()
+            logger.error("Unable to write %s to DB: %s" % (description, e), exc_info=(type(e), e, e.__traceback__))
+    return done
+
+def submit_write(coro, description, timeout=WRITE_TIMEOUT):
+    # Waits up to timeout for one of the MAX_PENDING_WRITES slots, the write
+    # is dropped (and logged) if the database is that far behind
+    semaphore = _pending_writes
+    if not semaphore.acquire(timeout=timeout):
+        coro.close()
+        logger.error("Dropping %s write, %s writes already pending" % (description, MAX_PENDING_WRITES))
+        return None
+    future = submit(coro)
+    future.add_done_callback(_write_done(description, semaphore))
+    return future
+
+async def gather(*coros):
+    return await asyncio.gather(*coros)
+
+async def get_latest_positions(execution_id):
+    async with connect_to_session(model.REPLICA) as session:
+        r = await session.execute(queries.latest_positions_query(execution_id))
+        return {symbol: value for symbol, value in r.all()}
+
+async def get_execution_metrics(execution_id):
+    async with connect_to_session(model.REPLICA) as session:
+        r = await session.execute(queries.execution_metrics_query(execution_id))
+        return queries.build_metrics_record(r.scalar_one_or_none())
+
+async def get_order_history(execution_id, page_size, **kwargs):
+    async with connect_to_session(model.REPLICA) as session:
+        r = await session.execute(queries.order_history_query(execution_id, page_size + 1, **kwargs))
+        return queries.build_order_history(r.all(), page_size)
+
+async def _write(description, rows, statements=()):
+    async with connect_to_session() as session:
+        try:
+            session.add_all(rows)
+            for statement in statements:
+                await session.execute(statement)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error("Unable to write %s to DB: %s" % (description, e), exc_info=True)
+
+async def write_transaction(timestamp, size, funds, price, statements=(), **kwargs):
+    await _write('transaction', [model.Transaction(timestamp=_to_datetime(timestamp), size=_to_float(size), funds=_to_float(funds), price=_to_float(price), **kwargs)], statements)
+
+async def write_user_transaction(product, fill=False, fee_rate=None, **kwargs):
+    statements = []
+    if fill and kwargs.get('execution_id') is not None:
+        statements.append(metrics.fill_statement(kwargs['execution_id'], _to_datetime(kwargs['timestamp']), kwargs['size'], kwargs['price'], fee_rate))
+    if fill:
+        statements.append(notify.notify_statement(notify.fill_event(kwargs.get('execution_id'), product, kwargs.get('side'), kwargs.get('size'), kwargs.get('price'), kwargs.get('timestamp'), kwargs.get('status'))))
+    await write_transaction(pair_id=await get_pair_id(product), statements=statements, **kwargs)
+
+def _coerce_row(row):
+    row = dict(row)
+    if 'timestamp' in row:
+        row['timestamp'] = _to_datetime(row['timestamp'])
+    for c in ['size', 'funds', 'price']:
+        if c in row:
+            row[c] = _to_float(row[c])
+    return row
+
+async def write_tick(batches, statements=()):
+    # Async counterpart of model.writer.TickWriter.commit
+    async with connect_to_session() as session:
+        try:
+            for table, rows in batches:
+                if rows:
+                    await session.execute(table.insert(), [_coerce_row(r) for r in rows])
+            for statement in statements:
+                await session.execute(statement)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error("Unable to write tick to DB: %s" % e, exc_info=True)
+
+async def get_pair_id(symbol):
+    async with connect_to_session() as session:
+        r = await session.execute(sqlalchemy.select(model.Pairs.id).filter(model.Pairs.symbol == symbol))
+        return r.scalar_one_or_none()
@@ -0,0 +1,64 @@
+import math
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import insert
+import model.db as model
+
+# Running per-execution analytics kept in execution_metrics. Each statement is
+# a single upsert so it can be executed inside the transaction that records the
+# underlying portfolio value or fill, and the dashboard reads one row instead
+# of scanning portfolio_value and transaction.
+
+def is_finite(value):
+    # NaN or inf (e.g. a missing price) would poison greatest() in Postgres:
+    # peak_value and max_drawdown could never recover
+    try:
+        return math.isfinite(float(value))
+    except (TypeError, ValueError):
+        return False
+
+def value_statement(execution_id, timestamp, value):
+    metrics = model.ExecutionMetrics.__table__
+    stmt = insert(metrics).values(
+        execution_id=execution_id,
+        timestamp=timestamp,
+        initial_value=value,
+        value=value,
+        peak_value=value
+    )
+    peak = sqlalchemy.func.greatest(sqlalchemy.func.coalesce(metrics.c.peak_value, stmt.excluded.value), stmt.excluded.value)
+    drawdown = sqlalchemy.func.coalesce(1 - stmt.excluded.value / sqlalchemy.func.nullif(peak, 0), 0)
+    return stmt.on_conflict_do_update(
+        index_elements=[metrics.c.execution_id],
+        set_={
+            'timestamp': stmt.excluded.timestamp,
+            'initial_value': sqlalchemy.func.coalesce(metrics.c.initial_value, stmt.excluded.value),
+            'value': stmt.excluded.value,
+            'peak_value': peak,
+            'pnl': stmt.excluded.value - sqlalchemy.func.coalesce(metrics.c.initial_value, stmt.excluded.value),
+            'drawdown': drawdown,
+            'max_drawdown': sqlalchemy.func.greatest(metrics.c.max_drawdown, drawdown)
+        }
+    )
+
+def fill_statement(execution_id, timestamp, size, price, fee_rate):
+    metrics = model.ExecutionMetrics.__table__
+    notional = float(size) * float(price)
+    fee = notional * float(fee_rate or 0)
+    stmt = insert(metrics).values(
+        execution_id=execution_id,
+        timestamp=timestamp,
+        turnover=notional,
+        fees=fee,
+        fills=1
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[metrics.c.execution_id],
+        set_={
+            'turnover': metrics.c.turnover + stmt.excluded.turnover,
+            'fees': metrics.c.fees + stmt.excluded.fees,
+            'fills': metrics.c.fills + 1
+        }
+    )
+
+def is_fill(msg):
+    return msg.get('type') == 'match' and msg.get('size') is not None and msg.get('price') is not None
\ No newline at end of file
@@ -0,0 +1,50 @@
+import json
+import sqlalchemy
+
+# Live updates for the dashboard over Postgres LISTEN/NOTIFY. Writers execute
+# a notify statement inside the transaction that stores the data, so the
+# event is delivered on commit and never for a rolled back write. NOTIFY
+# payloads must stay under 8000 bytes or pg_notify raises and aborts that
+# transaction, so price updates, which grow with the number of pairs, are
+# split into several events.
+
+CHANNEL = 'cryptobot_events'
+MAX_PAYLOAD = 7000
+
+def notify_statement(event):
+    return sqlalchemy.select(sqlalchemy.func.pg_notify(CHANNEL, json.dumps(event, default=str)))
+
+def prices_event(prices):
+    return {'type': 'prices', 'prices': prices}
+
+def prices_events(prices, max_payload=MAX_PAYLOAD):
+    # prices_event split into chunks whose payload stays under max_payload
+    events = []
+    chunk = {}
+    size = len(json.dumps(prices_event({})))
+    for symbol, price in prices.items():
+        item = len(json.dumps({symbol: price}, default=str))
+        if chunk and size + item > max_payload:
+            events.append(prices_event(chunk))
+            chunk = {}
+            size = len(json.dumps(prices_event({})))
+        chunk[symbol] = price
+        size += item
+    if chunk:
+        events.append(prices_event(chunk))
+    return events
+
+def value_event(execution_id, timestamp, value):
+    return {'type': 'value', 'execution_id': str(execution_id), 'timestamp': timestamp, 'value': value}
+
+def fill_event(execution_id, product, side, size, price, timestamp, status):
+    return {
+        'type': 'fill',
+        'execution_id': None if execution_id is None else str(execution_id),
+        'product_id': product,
+        'side': side,
+        'size': size,
+        'price': price,
+        'timestamp': timestamp,
+        'status': status
+    }
\ No newline at end of file
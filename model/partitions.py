@@ -0,0 +1,133 @@
+import re
+import datetime
+import logging
+import sqlalchemy
+import model.db as model
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+PARTITION_NAME = re.compile(r'_y(\d{4})m(\d{2})$')
+
+ROLLUP_QUERIES = {
+    'positions': """
+        INSERT INTO {schema}.positions_rollup (execution_id, symbol, "timestamp", value, average, samples)
+        SELECT execution_id, symbol, date_trunc('day', "timestamp"),
+               (array_agg(value ORDER BY "timestamp" DESC))[1], avg(value), count(*)
+        FROM {source}
+        WHERE "timestamp" < :until
+        GROUP BY execution_id, symbol, date_trunc('day', "timestamp")
+        ON CONFLICT (execution_id, symbol, "timestamp") DO NOTHING
+    """,
+    'portfolio_value': """
+        INSERT INTO {schema}.portfolio_value_rollup (execution_id, "timestamp", open, high, low, close, samples)
+        SELECT execution_id, date_trunc('day', "timestamp"),
+               (array_agg(value ORDER BY "timestamp"))[1], max(value), min(value),
+               (array_agg(value ORDER BY "timestamp" DESC))[1], count(*)
+        FROM {source}
+        WHERE "timestamp" < :until
+        GROUP BY execution_id, date_trunc('day', "timestamp")
+        ON CONFLICT (execution_id, "timestamp") DO NOTHING
+    """
+}
+
+def _month_start(d):
+    return datetime.datetime(d.year, d.month, 1)
+
+def _add_months(d, n):
+    month = d.month - 1 + n
+    return datetime.datetime(d.year + month // 12, month % 12 + 1, 1)
+
+def partition_name(table, month):
+    return "%s_y%04dm%02d" % (table.name, month.year, month.month)
+
+def get_partitions(session, table):
+    r = session.execute(sqlalchemy.text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        JOIN pg_namespace n ON n.oid = p.relnamespace
+        WHERE n.nspname = :schema AND p.relname = :table
+    """), {'schema': table.schema, 'table': table.name}).scalars().all()
+    partitions = {}
+    for name in r:
+        m = PARTITION_NAME.search(name)
+        if m is not None:
+            partitions[datetime.datetime(int(m.group(1)), int(m.group(2)), 1)] = name
+    return partitions
+
+def _quote(session, table, name=None):
+    preparer = session.connection().dialect.identifier_preparer
+    if name is None:
+        return preparer.format_table(table)
+    return "%s.%s" % (preparer.quote_schema(table.schema), preparer.quote(name))
+
+def create_partition(session, table, month):
+    # Rows for this month may already have landed in the default partition, so
+    # they are moved into the new table before it is attached.
+    start, end = month, _add_months(month, 1)
+    parent = _quote(session, table)
+    partition = _quote(session, table, partition_name(table, month))
+    default = _quote(session, table, table.name + '_default')
+    bounds = {'start': start, 'end': end}
+    session.execute(sqlalchemy.text("CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)" % (partition, parent)))
+    session.execute(sqlalchemy.text(
+        "WITH moved AS (DELETE FROM %s WHERE \"timestamp\" >= :start AND \"timestamp\" < :end RETURNING *) INSERT INTO %s SELECT * FROM moved" % (default, partition)),
+        bounds)
+    session.execute(sqlalchemy.text(
+        "ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM ('%s') TO ('%s')" % (parent, partition, start.isoformat(), end.isoformat())))
+    logger.info("Created partition %s" % partition)
+
+def ensure_partitions(session, months_ahead=1, now=None):
+    if now is None:
+        now = datetime.datetime.utcnow()
+    current = _month_start(now)
+    try:
+        for table in model.PARTITIONED_TABLES:
+            # Indexes added to the model after the table was created; an index
+            # on the parent is created on every partition
+            for index in table.indexes:
+                index.create(session.connection(), checkfirst=True)
+            existing = get_partitions(session, table)
+            for i in range(months_ahead + 1):
+                month = _add_months(current, i)
+                if month not in existing:
+                    create_partition(session, table, month)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error("Unable to create partitions: %s" % e, exc_info=True)
+
+def compact(session, retention_months=3, now=None):
+    # Rolls raw positions and portfolio values older than the retention window
+    # up into daily rows and drops the raw monthly partitions. Transactions are
+    # only partitioned, never compacted.
+    if now is None:
+        now = datetime.datetime.utcnow()
+    cutoff = _add_months(_month_start(now), -retention_months)
+    tables = [model.Positions.__table__, model.PortfolioValue.__table__]
+    schema = model.cbpro_metadata.schema
+    for table in tables:
+        try:
+            for month, name in sorted(get_partitions(session, table).items()):
+                if _add_months(month, 1) > cutoff:
+                    continue
+                partition = _quote(session, table, name)
+                session.execute(sqlalchemy.text(ROLLUP_QUERIES[table.name].format(schema=schema, source=partition)), {'until': cutoff})
+                session.execute(sqlalchemy.text("ALTER TABLE %s DETACH PARTITION %s" % (_quote(session, table), partition)))
+                session.execute(sqlalchemy.text("DROP TABLE %s" % partition))
+                session.commit()
+                logger.info("Compacted partition %s" % partition)
+            default = _quote(session, table, table.name + '_default')
+            session.execute(sqlalchemy.text(ROLLUP_QUERIES[table.name].format(schema=schema, source=default)), {'until': cutoff})
+            session.execute(sqlalchemy.text('DELETE FROM %s WHERE "timestamp" < :until' % default), {'until': cutoff})
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error("Unable to compact %s: %s" % (table.name, e), exc_info=True)
+
+if __name__ == "__main__":
+    session = model.connect_to_session()
+    ensure_partitions(session)
+    compact(session)
+    session.close()
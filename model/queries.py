@@ -0,0 +1,117 @@
+import datetime
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+import model.db as model
+
+# Statements are built here once and executed by both the sync helpers below
+# and their async counterparts in model.aio.
+
+def latest_positions_query(execution_id):
+    # The newest timestamp is found with LIMIT 1 over a backward scan of
+    # ix_positions_execution_id_timestamp, a single index probe per partition
+    # however long ago the execution last wrote; the positions are then read
+    # from the one partition holding that timestamp.
+    latest = sqlalchemy.select(model.Positions.timestamp).filter(model.Positions.execution_id == execution_id).order_by(model.Positions.timestamp.desc()).limit(1).scalar_subquery()
+    return sqlalchemy.select(model.Positions.symbol, model.Positions.value).filter(model.Positions.execution_id == execution_id, model.Positions.timestamp == latest)
+
+ORDER_COLUMNS = ['Timestamp', 'Pair', 'Size', 'Funds', 'Price', 'Side', 'Status']
+# Order events (received, matched, done) are written after the submitted
+# order; the bound lets the lateral lookup prune old partitions
+ORDER_EVENTS_SLACK = datetime.timedelta(minutes=5)
+
+def order_history_query(execution_id, limit, after=None, ascending=False, pair=None, side=None, status=None, start=None, end=None, offset=0):
+    # One row per submitted order, newest first. Pages are read with a keyset
+    # on (timestamp, id) of the submitted row. Without filters any page is an
+    # index range scan of `limit` rows on the partial index
+    # ix_transaction_pending_execution_id_timestamp_id, which holds exactly
+    # those rows in that order; each order's events are collapsed by a
+    # LATERAL aggregate over ix_transaction_order_id. Pair, side and status
+    # filters are applied on top of that scan and may read further, as does
+    # an offset, used to jump past the pages visited so far in one query.
+    order = model.Transaction.__table__.alias('o')
+    event = model.Transaction.__table__.alias('e')
+    matched = event.c.status == 'matched'
+    matched_size = sqlalchemy.func.sum(event.c.size).filter(matched)
+    events = sqlalchemy.select(
+        matched_size.label('size'),
+        (sqlalchemy.func.sum(event.c.size * event.c.price).filter(matched) / sqlalchemy.func.nullif(matched_size, 0)).label('price'),
+        sqlalchemy.func.array_agg(aggregate_order_by(event.c.status, event.c.timestamp.desc())).filter(event.c.status != 'other')[1].label('status')
+    ).where(
+        event.c.order_id == order.c.order_id,
+        event.c.timestamp >= order.c.timestamp - ORDER_EVENTS_SLACK
+    ).lateral('events')
+    stmt = sqlalchemy.select(
+        order.c.timestamp,
+        order.c.id,
+        model.Pairs.symbol,
+        events.c.size,
+        order.c.funds,
+        events.c.price,
+        order.c.side,
+        sqlalchemy.func.coalesce(events.c.status, order.c.status).label('status')
+    ).select_from(
+        order.join(model.Pairs.__table__, model.Pairs.id == order.c.pair_id).join(events, sqlalchemy.true())
+    ).where(
+        order.c.execution_id == execution_id,
+        order.c.status == 'pending'
+    )
+    if after is not None:
+        key = sqlalchemy.tuple_(order.c.timestamp, order.c.id)
+        cursor = sqlalchemy.tuple_(
+            sqlalchemy.bindparam('after_timestamp', after[0], type_=order.c.timestamp.type),
+            sqlalchemy.bindparam('after_id', after[1], type_=order.c.id.type))
+        stmt = stmt.where(key > cursor if ascending else key < cursor)
+    if pair is not None:
+        stmt = stmt.where(model.Pairs.symbol.ilike('%' + pair + '%'))
+    if side is not None:
+        stmt = stmt.where(order.c.side == side)
+    if status is not None:
+        stmt = stmt.where(sqlalchemy.func.coalesce(events.c.status, order.c.status) == status)
+    if start is not None:
+        stmt = stmt.where(order.c.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(order.c.timestamp < end)
+    if ascending:
+        stmt = stmt.order_by(order.c.timestamp.asc(), order.c.id.asc())
+    else:
+        stmt = stmt.order_by(order.c.timestamp.desc(), order.c.id.desc())
+    if offset:
+        stmt = stmt.offset(offset)
+    return stmt.limit(limit)
+
+def execution_metrics_query(execution_id):
+    return sqlalchemy.select(model.ExecutionMetrics).filter(model.ExecutionMetrics.execution_id == execution_id)
+
+def build_metrics_record(r):
+    if r is None:
+        return {}
+    return {c.name: getattr(r, c.name) for c in model.ExecutionMetrics.__table__.columns if c.name != 'execution_id'}
+
+def last_prices_query():
+    return sqlalchemy.select(model.LastPrice.symbol, model.LastPrice.price)
+
+def executions_query():
+    return sqlalchemy.select(model.Execution.id, model.Execution.name)
+
+def build_order_history(rows, page_size):
+    # Rows come from order_history_query with limit page_size + 1; the extra
+    # row only tells whether there is a next page
+    records = [
+        {'Timestamp': r.timestamp,
+        'Pair': r.symbol,
+        'Size': r.size,
+        'Funds': r.funds,
+        'Price': r.price,
+        'Side': r.side,
+        'Status': r.status} for r in rows[:page_size]]
+    last = rows[page_size - 1] if len(rows) > page_size else None
+    return records, None if last is None else (last.timestamp, last.id)
+
+def get_latest_positions(session, execution_id):
+    return {symbol: value for symbol, value in session.execute(latest_positions_query(execution_id)).all()}
+
+def get_execution_metrics(session, execution_id):
+    return build_metrics_record(session.execute(execution_metrics_query(execution_id)).scalar_one_or_none())
+
+def get_order_history(session, execution_id, page_size, **kwargs):
+    return build_order_history(session.execute(order_history_query(execution_id, page_size + 1, **kwargs)).all(), page_size)
\ No newline at end of file
@@ -0,0 +1,179 @@
+import io
+import csv
+import time
+import uuid
+import logging
+import sqlalchemy
+import model.db as model
+import model.metrics as metrics
+import model.notify as notify
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class TickWriter(object):
+    # Collects everything the bot persists during one tick (portfolio value,
+    # positions and submitted orders) and writes it in a single transaction.
+    # With bulk=True rows are streamed with COPY instead of executemany inserts,
+    # with asynchronous=True the write is handed to the model.aio event loop.
+
+    def __init__(self, session, execution_id, bulk=False, asynchronous=False):
+        self.session = session
+        self.execution_id = execution_id
+        self.bulk = bulk
+        self.asynchronous = asynchronous
+        self._pair_ids = {}
+        self.reset()
+
+    def reset(self):
+        self.amounts = []
+        self.positions = []
+        self.orders = []
+
+    def __len__(self):
+        return len(self.amounts) + len(self.positions) + len(self.orders)
+
+    def _get_pair_id(self, symbol):
+        if symbol not in self._pair_ids:
+            r = self.session.query(model.Pairs.id).filter(model.Pairs.symbol == symbol).one_or_none()
+            if r is None:
+                return None
+            self._pair_ids[symbol] = r.id
+        return self._pair_ids[symbol]
+
+    def add_amount(self, timestamp, amount):
+        self.amounts.append({'timestamp': timestamp, 'value': amount, 'execution_id': self.execution_id})
+
+    def add_positions(self, timestamp, positions):
+        self.positions.extend([{'timestamp': timestamp, 'symbol': c, 'value': v, 'execution_id': self.execution_id} for c, v in positions.items()])
+
+    def add_submitted_order(self, submitted_order):
+        # Rows that cannot be inserted are dropped here so that one bad order
+        # does not roll back the tick's portfolio value and positions
+        try:
+            pair_id = self._get_pair_id(submitted_order.get('product_id'))
+        except Exception as e:
+            self.session.rollback()
+            logger.error("Unable to look up pair for order %s: %s" % (submitted_order.get('id'), e), exc_info=True)
+            pair_id = None
+        if pair_id is None or submitted_order.get('created_at') is None:
+            logger.error("Not writing order %s for %s: unknown pair or no timestamp" % (submitted_order.get('id'), submitted_order.get('product_id')))
+            return False
+        self.orders.append({
+            'timestamp': submitted_order.get('created_at'),
+            'order_id': submitted_order.get('id'),
+            'pair_id': pair_id,
+            'size': submitted_order.get('size'),
+            'funds': submitted_order.get('funds'),
+            'price': None,
+            'side': submitted_order.get('side'),
+            'status': submitted_order.get('status'),
+            'execution_id': self.execution_id
+        })
+        return True
+
+    def _batches(self):
+        return [
+            (model.PortfolioValue.__table__, self.amounts),
+            (model.Positions.__table__, self.positions),
+            (model.Transaction.__table__, self.orders)
+        ]
+
+    def _statements(self, convert=lambda v: v):
+        statements = [metrics.value_statement(r['execution_id'], convert(r['timestamp']), r['value']) for r in self.amounts if metrics.is_finite(r['value'])]
+        if self.amounts and metrics.is_finite(self.amounts[-1]['value']):
+            # NaN is not valid JSON for the browser's JSON.parse
+            r = self.amounts[-1]
+            statements.append(notify.notify_statement(notify.value_event(r['execution_id'], r['timestamp'], r['value'])))
+        return statements
+
+    def _insert(self, table, rows):
+        self.session.execute(table.insert(), rows)
+
+    def _copy(self, table, rows):
+        connection = self.session.connection()
+        columns = list(rows[0].keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(['' if row[c] is None else row[c] for c in columns])
+        buffer.seek(0)
+        preparer = connection.dialect.identifier_preparer
+        statement = "COPY %s (%s) FROM STDIN WITH (FORMAT csv)" % (
+            preparer.format_table(table),
+            ', '.join(preparer.quote(c) for c in columns))
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(statement, buffer)
+        finally:
+            cursor.close()
+
+    def commit(self):
+        if len(self) == 0:
+            return 0
+        n = len(self)
+        if self.asynchronous:
+            import model.aio as aio
+            aio.submit_write(aio.write_tick(self._batches(), self._statements(aio._to_datetime)), 'tick')
+            self.reset()
+            return n
+        try:
+            for table, rows in self._batches():
+                if rows:
+                    if self.bulk:
+                        self._copy(table, rows)
+                    else:
+                        self._insert(table, rows)
+            for statement in self._statements():
+                self.session.execute(statement)
+            self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            logger.error("Unable to write tick to DB: %s" % e, exc_info=True)
+            n = 0
+        finally:
+            self.reset()
+            self.session.expunge_all()
+        return n
+
+def benchmark(session, ticks=1000, assets=50):
+    execution = model.Execution(parameters={}, name='benchmark-%s' % uuid.uuid4())
+    session.add(execution)
+    session.commit()
+    execution_id = execution.id
+    positions = {'A%s' % i: float(i) for i in range(assets)}
+    results = {}
+    try:
+        rows = 0
+        t0 = time.perf_counter()
+        for i in range(ticks):
+            timestamp = '2021-01-01T00:00:%02d.%06dZ' % (i % 60, i)
+            session.add(model.PortfolioValue(timestamp=timestamp, value=float(i), execution_id=execution_id))
+            session.commit()
+            session.add_all([model.Positions(timestamp=timestamp, symbol=c, value=v, execution_id=execution_id) for c, v in positions.items()])
+            session.commit()
+            rows += 1 + len(positions)
+        results['orm'] = rows / (time.perf_counter() - t0)
+        for mode in ['executemany', 'copy']:
+            writer = TickWriter(session, execution_id, bulk=(mode == 'copy'))
+            rows = 0
+            t0 = time.perf_counter()
+            for i in range(ticks):
+                timestamp = '2021-01-01T00:00:%02d.%06dZ' % (i % 60, i)
+                writer.add_amount(timestamp, float(i))
+                writer.add_positions(timestamp, positions)
+                rows += writer.commit()
+            results[mode] = rows / (time.perf_counter() - t0)
+    finally:
+        session.rollback()
+        session.execute(sqlalchemy.delete(model.Positions).where(model.Positions.execution_id == execution_id))
+        session.execute(sqlalchemy.delete(model.PortfolioValue).where(model.PortfolioValue.execution_id == execution_id))
+        session.execute(sqlalchemy.delete(model.Execution).where(model.Execution.id == execution_id))
+        session.commit()
+    return results
+
+if __name__ == "__main__":
+    session = model.connect_to_session()
+    for mode, rate in benchmark(session).items():
+        print("%s: %.0f rows/s" % (mode, rate))
+    session.close()
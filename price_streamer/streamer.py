@@ -2,6 +2,11 @@ import websocket
 import time
 import json
 import logging
+import threading
+from sqlalchemy.dialects.postgresql import insert
+import model.db as model
+import model.notify as notify
+from bot.ws import reconnect_delay, is_heartbeat
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -11,13 +16,21 @@ class CBPriceServer(object):
     host = "wss://ws-feed.pro.coinbase.com"
     wsc = None
 
-    def __init__(self, pairs, reconnect_interval=30,  ping=30, ping_timeout=15):
+    def __init__(self, pairs, reconnect_interval=1, max_reconnect_interval=60, ping=30, ping_timeout=15, flush_interval=0.25):
         self.pairs = pairs
-        self.channels = ['ticker']
+        self.channels = ['ticker', 'heartbeat']
         self._need_reconnection = False
         self._ping_interval=ping
         self._ping_timeout = ping_timeout
         self._reconnect_interval = reconnect_interval
+        self._max_reconnect_interval = max_reconnect_interval
+        self._attempts = 0
+        self.last_message = None
+        self._flush_interval = flush_interval
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._flusher = None
+        self._closed = threading.Event()
 
     def _build_subscribe_msg(self):
         subscribe_msg = {
@@ -31,19 +44,59 @@ class CBPriceServer(object):
         subscribe_msg = self._build_subscribe_msg()
         logger.debug("Connecting and sending subscribe message: %s" % subscribe_msg)
         self._need_reconnection = True
+        self.last_message = time.monotonic()
         try:
             ws.send(json.dumps(subscribe_msg))
         except Exception as e:
             logger.error("Unable to send subscribe message, connection will probably be closed by server")
 
     def _on_message(self, ws, msg):
+        self.last_message = time.monotonic()
+        self._attempts = 0
+        if is_heartbeat(msg):
+            return
         logger.debug("Received message: %s" % msg)
+        msg = json.loads(msg)
+        if msg.get('type') == 'ticker' and msg.get('product_id') is not None and 'price' in msg:
+            with self._pending_lock:
+                self._pending[msg['product_id']] = {'symbol': msg['product_id'], 'price': float(msg['price']), 'timestamp': msg.get('time')}
+
+    def flush(self, session):
+        # Publishes the latest price of every pair that ticked since the last
+        # flush, so dashboard workers can share this one feed, and notifies
+        # the dashboards listening for live updates
+        with self._pending_lock:
+            rows = list(self._pending.values())
+            self._pending = {}
+        if not rows:
+            return
+        stmt = insert(model.LastPrice.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[model.LastPrice.__table__.c.symbol],
+            set_={'price': stmt.excluded.price, 'timestamp': stmt.excluded.timestamp})
+        try:
+            session.execute(stmt, rows)
+            for event in notify.prices_events({r['symbol']: r['price'] for r in rows}):
+                session.execute(notify.notify_statement(event))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error("Unable to publish prices: %s" % e, exc_info=True)
+
+    def _flush_forever(self):
+        session = model.connect_to_session()
+        try:
+            while not self._closed.wait(self._flush_interval):
+                self.flush(session)
+        finally:
+            session.close()
 
     def _on_error(self, ws, msg):
         logger.debug("Received error: %s" % msg)
 
-    def _on_close(self, ws):
+    def _on_close(self, ws, *args):
         logger.debug("Connection closed")
+        self.last_message = None
 
     def _on_ping(self, ws, msg):
         logger.debug("Received PING: %s" % msg)
@@ -52,6 +105,9 @@ class CBPriceServer(object):
         logger.debug("Received PONG: %s" % msg)
 
     def connect(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_forever, name='price-flush', daemon=True)
+            self._flusher.start()
         websocket.enableTrace(True)
         self.wsc = websocket.WebSocketApp(
             self.host, 
@@ -63,15 +119,30 @@ class CBPriceServer(object):
             on_pong=self._on_pong)
 
         logger.debug("Connecting to server with ping interval %s and ping timeout %s" % (self._ping_interval, self._ping_timeout))
-        self.wsc.run_forever(ping_interval=self._ping_interval, ping_timeout=self._ping_timeout)
-        while self._need_reconnection:
-            logger.debug("Attempting to reconnect...")
+        self._need_reconnection = True
+        while not self._closed.is_set():
             self.wsc.run_forever(ping_interval=self._ping_interval, ping_timeout=self._ping_timeout)
-            time.sleep(self._reconnect_interval)
+            if not self._need_reconnection:
+                break
+            delay = reconnect_delay(self._attempts, self._reconnect_interval, self._max_reconnect_interval)
+            self._attempts += 1
+            logger.debug("Attempting to reconnect in %.1fs..." % delay)
+            if self._closed.wait(delay):
+                break
+
+    def check_health(self, timeout):
+        if self.last_message is not None and time.monotonic() - self.last_message > timeout:
+            logger.warning("No prices for %ss, forcing reconnection" % timeout)
+            self.last_message = None
+            if self.wsc is not None:
+                self.wsc.close()
+            return False
+        return True
 
     def close(self):
         logger.debug("Closing connection...")
         self._need_reconnection = False
+        self._closed.set()
         if self.wsc is not None:
             self.wsc.close()
 
@@ -1,7 +1,6 @@
 import logging
 import logging.handlers
 import argparse
-import bot.robot
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
@@ -25,6 +24,7 @@ def main():
     # add ch to logger
     logger.addHandler(ch1)
     logger.addHandler(ch2)
+    import bot.robot
     bot.robot.run(args.env, configuration_file=args.configuration)
 
 if __name__ == "__main__":
@@ -0,0 +1,35 @@
+import logging
+import logging.handlers
+import argparse
+import model.db
+import model.partitions
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--retention', default=3, type=int, help="Months of raw positions and portfolio values to keep")
+    parser.add_argument('-a', '--ahead', default=1, type=int, help="Months of partitions to create ahead of time")
+    args = parser.parse_args()
+    # create console handler and set level to debug
+    ch1 = logging.StreamHandler()
+    ch1.setLevel(logging.DEBUG)
+    #File logging
+    ch2 = logging.handlers.TimedRotatingFileHandler('maintenance.log', when='D', interval=1, backupCount=5, delay=False, utc=True)
+    # create formatter
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # add formatter to ch
+    ch1.setFormatter(formatter)
+    ch2.setFormatter(formatter)
+    # add ch to logger
+    logger.addHandler(ch1)
+    logger.addHandler(ch2)
+    session = model.db.connect_to_session()
+    logger.info("Creating partitions %s months ahead and compacting data older than %s months" % (args.ahead, args.retention))
+    model.partitions.ensure_partitions(session, months_ahead=args.ahead)
+    model.partitions.compact(session, retention_months=args.retention)
+    session.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
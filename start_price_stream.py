@@ -2,6 +2,7 @@ import logging
 import logging.handlers
 import json
 import price_streamer.streamer
+from bot.supervisor import ConnectionSupervisor
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
@@ -29,7 +30,9 @@ def main():
     pairs = ['-'.join([x, base_currency]) for x in products]
     if pairs:
         logger.info("Starting price stream for %s pairs" % pairs)
-        price_streamer.streamer.CBPriceServer(pairs).connect()
+        server = price_streamer.streamer.CBPriceServer(pairs)
+        ConnectionSupervisor([server], timeout=configuration.get("heartbeat_timeout", 30)).start()
+        server.connect()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
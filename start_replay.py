@@ -0,0 +1,33 @@
+import logging
+import argparse
+import datetime
+import json
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('journal', type=str, help="Journal file written by the bot")
+    parser.add_argument('-u', '--until', default=None, type=str, help="Replay up to this UTC time (ISO format)")
+    parser.add_argument('-n', '--events', default=None, type=int, help="Replay this many events")
+    parser.add_argument('-d', '--dump', nargs='*', default=None, type=str, help="Print events of the given kinds as JSON lines instead of the state")
+    args = parser.parse_args()
+    ch1 = logging.StreamHandler()
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch1.setFormatter(formatter)
+    logger.addHandler(ch1)
+    import bot.journal
+    if args.dump is not None:
+        kinds = {bot.journal.KIND_IDS[k] for k in args.dump} if args.dump else None
+        for event in bot.journal.iter_events(args.journal, kinds=kinds):
+            print(json.dumps(event))
+        return
+    until = None
+    if args.until is not None:
+        until = datetime.datetime.fromisoformat(args.until).replace(tzinfo=datetime.timezone.utc).timestamp()
+    state = bot.journal.replay(args.journal, until=until, max_events=args.events)
+    print(json.dumps(state.summary(), indent=2))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,55 @@
+import logging
+import logging.handlers
+import argparse
+import json
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('action', choices=['fetch', 'run'], help="Download price history or run a sweep over it")
+    parser.add_argument('-c', '--configuration', default='configuration', type=str, help="Configuration file providing universe and base currency")
+    parser.add_argument('-g', '--grid', default='sweep', type=str, help="JSON file mapping configuration parameters to lists of values")
+    parser.add_argument('-p', '--path', default='history', type=str, help="Directory holding the price history")
+    parser.add_argument('-d', '--days', default=30, type=int, help="Days of history to fetch")
+    parser.add_argument('--granularity', default=300, type=int, help="Candle size in seconds", choices=[60, 300, 900, 3600, 21600, 86400])
+    parser.add_argument('-w', '--workers', default=None, type=int, help="Worker processes, defaults to the number of cores")
+    parser.add_argument('-n', '--name', default=None, type=str, help="Sweep name used to prefix the executions")
+    parser.add_argument('--dry-run', action='store_true', help="Print results instead of writing executions")
+    args = parser.parse_args()
+    # create console handler and set level to debug
+    ch1 = logging.StreamHandler()
+    ch1.setLevel(logging.DEBUG)
+    # create formatter
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # add formatter to ch
+    ch1.setFormatter(formatter)
+    # add ch to logger
+    logger.addHandler(ch1)
+    import bot.sweep
+    if args.action == 'fetch':
+        import bot.robot
+        with open(args.configuration + '.json') as json_file:
+            configuration = json.load(json_file)
+        universe = configuration.get('universe')
+        logger.info("Fetching %s days of history for %s" % (args.days, universe))
+        bot.sweep.fetch_history(universe, configuration.get('base_currency'), days=args.days, granularity=args.granularity, path=args.path)
+        bot.sweep.save_market_caps(bot.robot.get_market_cap(bot.robot.get_mkt_cap_key()), universe, path=args.path)
+    else:
+        with open(args.grid + '.json') as json_file:
+            grid = json.load(json_file)
+        results = bot.sweep.run_sweep(grid, path=args.path, workers=args.workers)
+        if args.dry_run:
+            for parameters, result in results:
+                print(parameters, result)
+        else:
+            import model.db
+            name = args.name or bot.sweep.new_sweep_name()
+            session = model.db.connect_to_session()
+            bot.sweep.write_results(results, name, session)
+            session.close()
+            logger.info("Wrote %s executions for sweep %s" % (len(results), name))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,111 @@
+import os
+import json
+import bot.journal as journal
+
+# Replay regression: a journal written through Journal as run() does, replayed
+# in full, up to a timestamp and up to an event count.
+
+T0 = 1600000000.0
+
+def _write_session(path):
+    j = journal.Journal(path)
+    j.event(journal.CONFIGURATION, {'base_currency': 'BTC', 'universe': ['ETH', 'LTC']}, timestamp=T0)
+    j.tick('ETH-BTC', 0.03, 1000.0, timestamp=T0 + 1)
+    j.tick('LTC-BTC', 0.004, None, timestamp=T0 + 2)
+    j.raw(journal.USER, json.dumps({'type': 'received', 'order_id': 'o1', 'product_id': 'ETH-BTC'}), timestamp=T0 + 3)
+    j.event(journal.MARKET_CAPS, {'ETH': {'rank': 2, 'market_cap': 1e6}, 'LTC': {'rank': 9, 'market_cap': 1e5}}, timestamp=T0 + 4)
+    j.event(journal.PRICES, {'ETH-BTC': 0.03, 'LTC-BTC': 0.004}, timestamp=T0 + 5)
+    j.rest('get_accounts', [{'currency': 'BTC', 'balance': '1.0'}], timestamp=T0 + 6)
+    j.event(journal.WEIGHTS, {'ETH': 0.45, 'LTC': 0.45}, timestamp=T0 + 7)
+    j.event(journal.POSITIONS, {'BTC': 1.0, 'ETH': 0.0, 'LTC': 0.0}, timestamp=T0 + 8)
+    j.event(journal.ORDERS, [[0.45, 'ETH'], [0.45, 'LTC']], timestamp=T0 + 9)
+    j.rest('place_market_order', {'id': 'o2', 'status': 'pending'}, request={'product_id': 'ETH-BTC', 'side': 'buy', 'funds': 0.45}, timestamp=T0 + 10)
+    j.raw(journal.USER, json.dumps({'type': 'done', 'order_id': 'o1', 'product_id': 'ETH-BTC', 'reason': 'filled'}), timestamp=T0 + 11)
+    j.tick('ETH-BTC', 0.031, 1001.0, timestamp=T0 + 12)
+    j.close()
+    return j
+
+def test_replay_summary(tmp_path):
+    path = str(tmp_path / 'session.bin')
+    j = _write_session(path)
+    state = journal.replay(path)
+    # Two symbol records besides the 13 events
+    assert j.records == 15
+    assert state.events == 15
+    assert state.summary() == {
+        'events': 15,
+        'timestamp': '2020-09-13T12:26:52',
+        'last_prices': {'ETH-BTC': 0.031, 'LTC-BTC': 0.004},
+        'current_orders': {},
+        'target_weights': {'ETH': 0.45, 'LTC': 0.45},
+        'positions': {'BTC': 1.0, 'ETH': 0.0, 'LTC': 0.0},
+        'orders': [[0.45, 'ETH'], [0.45, 'LTC']]
+    }
+    assert state.last_volumes == {'ETH-BTC': 1001.0}
+    assert state.market_caps['ETH']['rank'] == 2
+    assert state.configuration['universe'] == ['ETH', 'LTC']
+    assert state.rest['place_market_order'] == {'id': 'o2', 'status': 'pending'}
+
+def test_replay_until(tmp_path):
+    path = str(tmp_path / 'session.bin')
+    _write_session(path)
+    state = journal.replay(path, until=T0 + 7)
+    summary = state.summary()
+    assert summary['timestamp'] == '2020-09-13T12:26:47'
+    assert summary['last_prices'] == {'ETH-BTC': 0.03, 'LTC-BTC': 0.004}
+    assert summary['current_orders'] == {'ETH-BTC': ['o1']}
+    assert summary['target_weights'] == {'ETH': 0.45, 'LTC': 0.45}
+    assert summary['positions'] == {}
+    assert summary['orders'] == []
+    assert 'place_market_order' not in state.rest
+
+def test_replay_max_events(tmp_path):
+    path = str(tmp_path / 'session.bin')
+    _write_session(path)
+    # configuration, ETH symbol and tick, LTC symbol and tick, received
+    state = journal.replay(path, max_events=6)
+    summary = state.summary()
+    assert summary['events'] == 6
+    assert summary['last_prices'] == {'ETH-BTC': 0.03, 'LTC-BTC': 0.004}
+    assert summary['current_orders'] == {'ETH-BTC': ['o1']}
+    assert summary['target_weights'] == {}
+    assert state.market_caps == {}
+
+def test_iter_events_round_trip(tmp_path):
+    path = str(tmp_path / 'session.bin')
+    _write_session(path)
+    events = list(journal.iter_events(path, kinds={journal.TICK_EVENT}))
+    assert [e['data'] for e in events] == [
+        {'product_id': 'ETH-BTC', 'price': 0.03, 'volume_24h': 1000.0},
+        {'product_id': 'LTC-BTC', 'price': 0.004, 'volume_24h': None},
+        {'product_id': 'ETH-BTC', 'price': 0.031, 'volume_24h': 1001.0}
+    ]
+
+def test_reopen_truncates_partial_record(tmp_path):
+    path = str(tmp_path / 'session.bin')
+    _write_session(path)
+    complete = os.path.getsize(path)
+    # A crash in the middle of a record: header and half the payload
+    with open(path, 'ab') as f:
+        f.write(journal.HEADER.pack(100, journal.WEIGHTS, T0 + 13) + b'{"ETH": 0.')
+    assert journal.replay(path).events == 15
+    j = journal.Journal(path)
+    assert os.path.getsize(path) == complete
+    # Symbol ids continue the existing table
+    assert j.symbols == {'ETH-BTC': 0, 'LTC-BTC': 1}
+    j.tick('LTC-BTC', 0.005, 10.0, timestamp=T0 + 14)
+    j.event(journal.WEIGHTS, {'ETH': 0.9, 'LTC': 0.0}, timestamp=T0 + 15)
+    j.close()
+    state = journal.replay(path)
+    assert state.events == 17
+    assert state.last_prices == {'ETH-BTC': 0.031, 'LTC-BTC': 0.005}
+    assert state.target_weights == {'ETH': 0.9, 'LTC': 0.0}
+
+def test_reopen_truncates_partial_header(tmp_path):
+    path = str(tmp_path / 'session.bin')
+    _write_session(path)
+    complete = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write(journal.HEADER.pack(4, journal.TICK_EVENT, T0 + 13)[:5])
+    journal.Journal(path).close()
+    assert os.path.getsize(path) == complete
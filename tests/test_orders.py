@@ -0,0 +1,122 @@
+import gc
+import os
+import random
+import threading
+from bot.orders import OrderTracker
+
+# Order bookkeeping: messages that beat their order, concurrent access from a
+# feed thread, and a soak of synthetic user channel traffic checking that
+# resident memory stays flat as the bot keeps running.
+
+def _rss():
+    # Current resident set size in bytes
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _order(order_id, product='A-BTC', funds='1.0'):
+    return {'id': order_id, 'product_id': product, 'side': 'buy', 'funds': funds, 'status': 'pending'}
+
+def test_done_before_submit():
+    tracker = OrderTracker()
+    tracker.on_user_message({'type': 'match', 'taker_order_id': 'o1', 'maker_order_id': 'm1', 'product_id': 'A-BTC', 'size': '2', 'price': '0.5'})
+    tracker.on_user_message({'type': 'done', 'order_id': 'o1', 'product_id': 'A-BTC', 'reason': 'filled'})
+    assert tracker.submit(_order('o1'))
+    assert tracker.open_funds() == {}
+    assert tracker.aggregates['A-BTC'].as_dict() == {'orders': 1, 'funds': 1.0, 'filled_size': 2.0, 'filled_funds': 1.0, 'canceled': 0, 'expired': 0}
+
+def test_early_messages_expire():
+    now = [0.0]
+    tracker = OrderTracker(max_age=3600, early_ttl=60, clock=lambda: now[0])
+    tracker.on_user_message({'type': 'done', 'order_id': 'o1', 'product_id': 'A-BTC', 'reason': 'filled'})
+    now[0] = 120.0
+    tracker.expire()
+    assert len(tracker.early) == 0
+    tracker.submit(_order('o1'))
+    assert tracker.open_funds() == {'A-BTC': 1.0}
+
+def test_concurrent_messages():
+    tracker = OrderTracker()
+    n = 20000
+    stop = threading.Event()
+
+    def feed():
+        for i in range(n):
+            tracker.on_user_message({'type': 'done', 'order_id': 'o%s' % i, 'product_id': 'A-BTC', 'reason': 'filled'})
+
+    def main_loop():
+        while not stop.is_set():
+            tracker.expire()
+            tracker.open_funds()
+
+    thread = threading.Thread(target=main_loop)
+    thread.start()
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    try:
+        for i in range(n):
+            tracker.submit(_order('o%s' % i))
+        feeder.join()
+    finally:
+        stop.set()
+        thread.join()
+    # Each done is applied either directly or when its order is submitted
+    assert tracker.aggregates['A-BTC'].orders == n
+    assert len(tracker) == 0
+    assert len(tracker.early) == 0
+
+def soak(days=3, timestep=60, pairs=20, orders_per_tick=2, lost_done=0.01, early_done=0.05, seed=0):
+    # Replays `days` of synthetic user channel traffic through an
+    # OrderTracker as run() drives it, 5% of orders having their messages
+    # arrive before the REST response submits them; returns the RSS at the
+    # end of each day
+    r = random.Random(seed)
+    products = ['C%s-BTC' % i for i in range(pairs)]
+    clock = [0.0]
+    tracker = OrderTracker(max_age=3600, clock=lambda: clock[0])
+    samples = []
+    sequence = 0
+    for day in range(days):
+        for tick in range(86400 // timestep):
+            clock[0] += timestep
+            for _ in range(orders_per_tick):
+                sequence += 1
+                order_id = '%032x' % sequence
+                product = products[r.randrange(pairs)]
+                response = {'id': order_id, 'product_id': product, 'side': 'buy', 'funds': '0.001', 'status': 'pending'}
+                early = r.random() < early_done
+                if not early:
+                    tracker.submit(response)
+                messages = [
+                    {'type': 'received', 'order_id': order_id, 'product_id': product},
+                    {'type': 'match', 'taker_order_id': order_id, 'product_id': product, 'size': '0.5', 'price': '0.002'}
+                ]
+                if r.random() >= lost_done:
+                    messages.append({'type': 'done', 'order_id': order_id, 'product_id': product, 'reason': 'filled'})
+                for msg in messages:
+                    tracker.on_user_message(msg)
+                if early:
+                    tracker.submit(response)
+            tracker.expire()
+        gc.collect()
+        samples.append(_rss())
+    return samples, tracker, sequence
+
+def test_soak():
+    samples, tracker, submitted = soak()
+    # Memory after the first day stays flat
+    growth = max(samples[1:]) - samples[0]
+    assert growth < 2 << 20, "RSS grew by %s bytes" % growth
+    # Every order is either completed or still open, including those whose
+    # done arrived before submit
+    completed = sum(a.orders for a in tracker.aggregates.values())
+    assert completed + len(tracker) == submitted
+    expired = sum(a.expired for a in tracker.aggregates.values())
+    assert expired <= 0.02 * submitted
+    # Only orders younger than max_age are open and no early message outlives
+    # its ttl
+    assert len(tracker) <= 3600 // 60 * 2
+    assert len(tracker.early) == 0